@@ -0,0 +1,279 @@
+# Description: Implementation of the KubaBatch class. KubaBatch steps many Kuba games at once. It holds
+# N boards as an (N, 7, 7) int8 NumPy array and applies one move per board in a single vectorized call,
+# with the same rules as KubaGame.validate_move and KubaGame.make_move. Only the 7x7 game won with 7 red
+# captures is supported.
+import numpy as np
+
+# marble codes used in the board arrays; MARBLES[code] is the KubaGame marble character
+EMPTY, WHITE, BLACK, RED = 0, 1, 2, 3
+MARBLES = "XWBR"
+
+# direction codes; DIRECTIONS[code] is the KubaGame direction character
+DIRECTIONS = "BFLR"
+
+START_BOARD = [
+    "WWXXXBB",
+    "WWXRXBB",
+    "XXRRRXX",
+    "XRRRRRX",
+    "XXRRRXX",
+    "BBXRXWW",
+    "BBXXXWW",
+]
+
+
+def _build_line_tables():
+    """
+    Precomputes, for every square and direction, the 7 flat board indices of the row or column
+    a push moves along, ordered in the direction of the push, and the position of the square in it.
+    """
+    line_index = np.zeros((7, 7, 4, 7), dtype=np.intp)
+    line_position = np.zeros((7, 7, 4), dtype=np.intp)
+    for row in range(7):
+        for column in range(7):
+            for code, direction in enumerate(DIRECTIONS):
+                if direction == "B":
+                    squares = [(index, column) for index in range(7)]
+                elif direction == "F":
+                    squares = [(index, column) for index in reversed(range(7))]
+                elif direction == "R":
+                    squares = [(row, index) for index in range(7)]
+                else:
+                    squares = [(row, index) for index in reversed(range(7))]
+                line_index[row, column, code] = [7 * square[0] + square[1] for square in squares]
+                line_position[row, column, code] = squares.index((row, column))
+    return line_index, line_position
+
+
+_LINE_INDEX, _LINE_POSITION = _build_line_tables()
+
+# the same tables for every move, in KubaRecord order: move = (row * 7 + column) * 4 + direction code
+_MOVE_LINE_INDEX = _LINE_INDEX.reshape(196, 7)
+_MOVE_POSITION = _LINE_POSITION.reshape(196)
+
+
+def marble_codes(rows):
+    """
+    Takes a list of rows (each a list or string of W, B, R, X marbles).
+    Returns the board as a (7, 7) int8 array of marble codes.
+    """
+    return np.array([[MARBLES.index(marble) for marble in row] for row in rows], dtype=np.int8)
+
+
+class KubaBatch:
+    """
+    The class representing N Kuba games played in lockstep. Players are numbered 0 (player A) and 1 (player B).
+    """
+    def __init__(self, size, colors=(WHITE, BLACK)):
+        """
+        Takes the number of games and the marble codes of player A and player B, either one pair
+        for every game or an (N, 2) array. Initializes every game to the starting board.
+        """
+        self._size = size
+        self._boards = np.broadcast_to(marble_codes(START_BOARD), (size, 7, 7)).copy()
+        self._colors = np.broadcast_to(np.asarray(colors, dtype=np.int8), (size, 2)).copy()
+        self._turn = np.full(size, -1, dtype=np.int8)          # player to move, -1 before the first move
+        self._red = np.zeros((size, 2), dtype=np.int16)        # each player's captured red count
+        self._winner = np.full(size, -1, dtype=np.int8)        # winning player, -1 if no winner yet
+        # the board a move may not recreate (the board before the last call to step that was not
+        # rolled back, as KubaGame compares against _pre_opponent_move), and whether there is one
+        self._ko_boards = self._boards.copy()
+        self._has_ko = np.zeros(size, dtype=bool)
+
+    @classmethod
+    def from_game(cls, game, size):
+        """
+        Takes a KubaGame and a number of games.
+        Returns a batch of that many copies of the game's position, with its turn, red captures,
+        winner and the board its next move may not recreate.
+        Raises ValueError if the game is not the 7x7 game won with 7 red captures.
+        """
+        if game.get_size() != 7 or game.get_red_to_win() != 7:
+            raise ValueError("KubaBatch only plays the 7x7 game won with 7 red captures, not a %d x %d board "
+                             "won with %d" % (game.get_size(), game.get_size(), game.get_red_to_win()))
+        name_a, color_a = game.get_A()
+        name_b, color_b = game.get_B()
+        batch = cls(size, (MARBLES.index(color_a), MARBLES.index(color_b)))
+        board = marble_codes([[game.get_marble((row, column)) for column in range(7)] for row in range(7)])
+        batch._boards[:] = board
+        turn = game.get_current_turn()
+        batch._turn[:] = -1 if turn is None else (0 if turn == name_a else 1)
+        batch._red[:] = (game.get_captured(name_a), game.get_captured(name_b))
+        winner = game.get_winner()
+        batch._winner[:] = -1 if winner is None else (0 if winner == name_a else 1)
+
+        # the board the next move may not recreate is the current board after a rejected call,
+        # otherwise the board before the last move
+        history = game.get_pre_oppo_move()
+        if len(history) > 0:
+            if history[0] == game.get_board_hash():
+                batch._ko_boards[:] = board
+                batch._has_ko[:] = True
+            else:
+                before = game.fork()
+                if before.unmake_move() and before.get_board_hash() == history[0]:
+                    batch._ko_boards[:] = marble_codes([[before.get_marble((row, column)) for column in range(7)]
+                                                        for row in range(7)])
+                    batch._has_ko[:] = True
+        return batch
+
+    def get_size(self):
+        """
+        Returns the number of games in the batch.
+        """
+        return self._size
+
+    def get_boards(self):
+        """
+        Returns the (N, 7, 7) array of marble codes. The array is the batch's own; do not modify it.
+        """
+        return self._boards
+
+    def get_board(self, index):
+        """
+        Takes a game index. Returns the game's board as a 7x7 list of W, B, R, X characters.
+        """
+        return [[MARBLES[code] for code in row] for row in self._boards[index].tolist()]
+
+    def get_current_turn(self):
+        """
+        Returns the (N,) array of the player to move in each game, -1 before the first move.
+        """
+        return self._turn
+
+    def get_captured(self):
+        """
+        Returns the (N, 2) array of red marbles captured by player A and player B.
+        """
+        return self._red
+
+    def get_winner(self):
+        """
+        Returns the (N,) array of winning players, -1 where there is no winner yet.
+        """
+        return self._winner
+
+    def get_marble_count(self):
+        """
+        Returns the (N, 3) array of W, B and R marbles on each board.
+        """
+        flat = self._boards.reshape(self._size, 49)
+        return np.stack([(flat == WHITE).sum(axis=1), (flat == BLACK).sum(axis=1),
+                         (flat == RED).sum(axis=1)], axis=1)
+
+    def legal_mask(self, players):
+        """
+        Takes an (N,) array of the player to move in each game.
+        Returns an (N, 196) boolean array of the moves (numbered as in KubaRecord) that pass every
+        check of step except ko: the player's own marble, not on the edge ahead, the edge or an
+        empty square preceding it, and not pushing off the player's own marble.
+        Games that are over have no legal moves.
+        """
+        size = self._size
+        players = np.clip(np.asarray(players, dtype=np.intp), 0, 1)
+        flat = self._boards.reshape(size, 49)
+        lines = flat[:, _MOVE_LINE_INDEX]                               # (N, 196, 7)
+        moves = np.arange(196)
+        color = self._colors[np.arange(size), players][:, None]
+        legal = lines[:, moves, _MOVE_POSITION] == color
+        legal &= (_MOVE_POSITION < 6)[None, :]
+        preceding = lines[:, moves, np.maximum(_MOVE_POSITION - 1, 0)]
+        legal &= (_MOVE_POSITION == 0)[None, :] | (preceding == EMPTY)
+        ahead = np.arange(7)[None, :] > _MOVE_POSITION[:, None]         # (196, 7)
+        has_gap = (ahead[None, :, :] & (lines == EMPTY)).any(axis=2)
+        legal &= has_gap | (lines[:, :, 6] != color)
+        legal &= (self._winner < 0)[:, None]
+        return legal
+
+    def check_moves(self, players, rows, columns, directions, active=None):
+        """
+        Takes the arguments of step. Applies the rules of validate_move and make_move to one move
+        in every active game, without changing the batch.
+        Returns four arrays: (N,) whether the move is valid, (N,) whether it fails the checks of
+        validate_move (as opposed to being rolled back by make_move), (N, 49) the boards after the
+        moves, and (N,) the marble code each valid move pushes off (EMPTY if none).
+        """
+        size = self._size
+        games = np.arange(size)
+        players = np.asarray(players, dtype=np.intp)
+        rows = np.asarray(rows, dtype=np.intp)
+        columns = np.asarray(columns, dtype=np.intp)
+        directions = np.asarray(directions, dtype=np.intp)
+        if active is None:
+            active = np.ones(size, dtype=bool)
+
+        # the checks of validate_move, for every game at once
+        valid = active & (self._winner < 0)
+        valid &= (players == 0) | (players == 1)
+        valid &= (rows >= 0) & (rows < 7) & (columns >= 0) & (columns < 7)
+        valid &= (directions >= 0) & (directions < 4)
+        valid &= (self._turn < 0) | (self._turn == players)
+        players = np.clip(players, 0, 1)
+        rows = np.clip(rows, 0, 6)
+        columns = np.clip(columns, 0, 6)
+        directions = np.clip(directions, 0, 3)
+
+        flat = self._boards.reshape(size, 49)
+        line_index = _LINE_INDEX[rows, columns, directions]
+        position = _LINE_POSITION[rows, columns, directions]
+        line = flat[games[:, None], line_index]
+        color = self._colors[games, players]
+        valid &= line[games, position] == color
+        # cannot push towards the edge the marble is standing on
+        valid &= position < 6
+        # the preceding square must be the edge of the board or empty
+        valid &= (position == 0) | (line[games, np.maximum(position - 1, 0)] == EMPTY)
+        rejected = active & ~valid
+
+        # push every line: the marbles from the square up to the first vacant square (or to the
+        # edge, pushing the edge marble off) move one step ahead
+        steps = np.arange(7)
+        ahead = steps > position[:, None]
+        vacant_ahead = ahead & (line == EMPTY)
+        has_gap = vacant_ahead.any(axis=1)
+        gap = np.where(has_gap, vacant_ahead.argmax(axis=1), 6)
+        shifted = np.concatenate([np.zeros((size, 1), dtype=line.dtype), line[:, :-1]], axis=1)
+        new_line = np.where(ahead & (steps <= gap[:, None]), shifted, line)
+        new_line[games, position] = EMPTY
+        pushed_off = np.where(has_gap, EMPTY, line[:, 6]).astype(np.int8)
+
+        # cannot push off your own marble
+        valid &= pushed_off != color
+        new_flat = flat.copy()
+        new_flat[games[:, None], line_index] = new_line
+        # cannot undo the opponent's last move
+        valid &= ~(self._has_ko & (new_flat == self._ko_boards.reshape(size, 49)).all(axis=1))
+        pushed_off[~valid] = EMPTY
+        return valid, rejected, new_flat, pushed_off
+
+    def step(self, players, rows, columns, directions, active=None):
+        """
+        Takes (N,) arrays of players, rows, columns and direction codes, and optionally an (N,)
+        boolean array of the games to step. Makes one move in every active game.
+        Returns three (N,) arrays: whether the move was valid and made, the marble code pushed off
+        by a valid move (EMPTY if none), and the winning player after the move (-1 if none).
+        """
+        size = self._size
+        games = np.arange(size)
+        valid, rejected, new_flat, pushed_off = self.check_moves(players, rows, columns, directions, active)
+        players = np.clip(np.asarray(players, dtype=np.intp), 0, 1)
+
+        # a rejected call remembers the current board; a rolled back push remembers nothing
+        remember = valid | rejected
+        self._ko_boards[remember] = self._boards[remember]
+        self._has_ko |= remember
+
+        self._boards[valid] = new_flat[valid].reshape(-1, 7, 7)
+        captured = valid & (pushed_off == RED)
+        self._red[games[captured], players[captured]] += 1
+        self._turn[valid] = 1 - players[valid]
+
+        # get_winner: 7 captured reds first, then a color with no marbles left
+        counts = self.get_marble_count()
+        winner = np.full(size, -1, dtype=np.int8)
+        winner = np.where(counts[:, 1] == 0, (self._colors[:, 0] != WHITE).astype(np.int8), winner)
+        winner = np.where(counts[:, 0] == 0, (self._colors[:, 0] != BLACK).astype(np.int8), winner)
+        winner = np.where(self._red[:, 1] >= 7, 1, winner)
+        winner = np.where(self._red[:, 0] >= 7, 0, winner)
+        self._winner = np.where(valid, winner, self._winner).astype(np.int8)
+        return valid, pushed_off, self._winner.copy()
@@ -0,0 +1,290 @@
+# Description: Benchmark suite for the KubaGame hot paths. Times validate_move, each push routine in its
+# vacant-ahead and push-off branches, count_consecutive, get_marble_count, get_winner and full random
+# games on fixed board fixtures and seeds. Reports ops/sec and peak bytes allocated per op, and compares
+# the results with a stored baseline so that regressions show up. With --scaling, times the same paths on
+# N x N boards instead, pushing a full line of N marbles, and reports the cost per op for every N.
+#
+# The committed KubaBenchmark.json baseline was made with "python KubaBenchmark.py --save". Timings depend on
+# the machine, so before comparing changes, run --save on the unchanged tree to make a baseline for that
+# machine, then run without --save after the change.
+#
+# Usage: python KubaBenchmark.py [--baseline PATH] [--save] [--threshold 0.1] [--only NAME ...]
+#        python KubaBenchmark.py --scaling [--sizes 7 11 21 51 101]
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from KubaGame import KubaGame
+from KubaSelfPlay import random_policy
+
+DEFAULT_BASELINE = "KubaBenchmark.json"
+PLAYERS = (("A", "W"), ("B", "B"))
+
+# marbles along the pushed line, in push order, starting at the pushed marble
+VACANT_AHEAD_LINE = "WWBRXXX"
+PUSH_OFF_LINE = "WWBRBRB"
+SCALING_SIZES = (7, 11, 21, 51, 101)
+
+
+def fixture_board(direction, line):
+    """
+    Takes a direction and the marbles of a line in push order, one per square of a row.
+    Returns a board as wide as the line that is empty except for the line, laid along the middle
+    row (L, R) or column (F, B).
+    """
+    size = len(line)
+    middle = size // 2
+    board = [["X"] * size for row in range(size)]
+    for index in range(size):
+        if direction == "R":
+            board[middle][index] = line[index]
+        elif direction == "L":
+            board[middle][size - 1 - index] = line[index]
+        elif direction == "B":
+            board[index][middle] = line[index]
+        else:
+            board[size - 1 - index][middle] = line[index]
+    return board
+
+
+def fixture_start(direction, size=7):
+    """
+    Takes a direction and the board size. Returns the coordinates of the first marble of a
+    fixture_board line.
+    """
+    middle = size // 2
+    return {"R": (middle, 0), "L": (middle, size - 1), "B": (0, middle), "F": (size - 1, middle)}[direction]
+
+
+class Benchmark:
+    """
+    The class representing one timed operation. reset, if given, runs untimed before every op.
+    """
+    def __init__(self, name, op, reset=None):
+        """
+        Takes the benchmark name, the operation to time and the untimed reset to run before it.
+        """
+        self.name = name
+        self.op = op
+        self.reset = reset
+
+    def time_ops(self, count):
+        """
+        Takes a number of ops. Runs them and returns the seconds spent in the ops.
+        """
+        op = self.op
+        reset = self.reset
+        if reset is None:
+            start = time.perf_counter()
+            for index in range(count):
+                op()
+            return time.perf_counter() - start
+        total = 0.0
+        for index in range(count):
+            reset()
+            start = time.perf_counter()
+            op()
+            total += time.perf_counter() - start
+        return total
+
+    def measure(self, min_time=0.2, repeat=5):
+        """
+        Takes the least time one repeat should take and the number of repeats.
+        Returns a dict with the best ops/sec of the repeats and the peak bytes allocated by one op.
+        """
+        count = 1
+        while self.time_ops(count) < min_time / 10:
+            count *= 2
+        count = max(1, int(count * min_time / max(self.time_ops(count), 1e-9)))
+        best = min(self.time_ops(count) for index in range(repeat))
+
+        if self.reset is not None:
+            self.reset()
+        tracemalloc.start()
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        self.op()
+        peak_bytes = tracemalloc.get_traced_memory()[1] - start_bytes
+        tracemalloc.stop()
+        return {"ops_per_sec": count / best, "alloc_bytes": peak_bytes}
+
+
+def push_benchmark(direction, push_off):
+    """
+    Takes a direction and whether the push pushes a marble off.
+    Returns the Benchmark of the matching push routine on a fixture board.
+    """
+    game = KubaGame(*PLAYERS)
+    board = fixture_board(direction, PUSH_OFF_LINE if push_off else VACANT_AHEAD_LINE)
+    coordinates = fixture_start(direction)
+    push = {"R": game.push_right, "L": game.push_left, "B": game.push_down, "F": game.push_up}[direction]
+
+    def reset():
+        game.set_board(board)
+        game._pushed_off = None
+
+    name = "%s_%s" % (push.__name__, "push_off" if push_off else "vacant_ahead")
+    return Benchmark(name, lambda: push(coordinates, direction), reset)
+
+
+def random_game():
+    """
+    Plays a full game of random legal moves from a fixed seed. Returns the number of moves made.
+    """
+    rng = random.Random(2021)
+    game = KubaGame(*PLAYERS)
+    playerName = "A"
+    moves = 0
+    while moves < 1000:
+        move = random_policy(game, playerName, rng)
+        if move is None or not game.make_move(playerName, move[0], move[1]):
+            break
+        moves += 1
+        if game.get_winner() is not None:
+            break
+        playerName = game.get_current_turn()
+    return moves
+
+
+def get_benchmarks():
+    """
+    Returns the list of Benchmarks of the suite.
+    """
+    start = KubaGame(*PLAYERS)
+    counting = KubaGame(*PLAYERS)
+    counting.set_board(fixture_board("R", VACANT_AHEAD_LINE))
+    benchmarks = [
+        Benchmark("validate_move", lambda: start.validate_move("A", (6, 6), "F")),
+        Benchmark("count_consecutive", lambda: counting.count_consecutive((3, 0), "R")),
+        Benchmark("get_marble_count", start.get_marble_count),
+        Benchmark("get_winner", start.get_winner),
+    ]
+    for direction in ("R", "L", "B", "F"):
+        for push_off in (False, True):
+            benchmarks.append(push_benchmark(direction, push_off))
+    benchmarks.append(Benchmark("random_game", random_game))
+    return benchmarks
+
+
+def scaling_line(size):
+    """
+    Takes the board size. Returns a full line of marbles for A (W) to push: its own marble first,
+    then alternating R and B marbles, so that a push moves every marble of the line and pushes
+    one off.
+    """
+    return "W" + ("RB" * size)[:size - 1]
+
+
+def get_scaling_benchmarks(size):
+    """
+    Takes the board size.
+    Returns the list of Benchmarks of the paths whose cost depends on the line length, on a
+    size x size board holding one full line, along a row and along a column: validating and
+    counting the push, and making it (validation, push, hash and index updates) and taking it back.
+    The push routines on their own are not timed, as their reset would cost size x size.
+    """
+    benchmarks = []
+    for direction in ("R", "B"):
+        game = KubaGame(*PLAYERS, board=fixture_board(direction, scaling_line(size)))
+        coordinates = fixture_start(direction, size)
+        benchmarks.append(Benchmark("validate_move_%s" % direction,
+                                    lambda game=game, coordinates=coordinates, direction=direction:
+                                    game.validate_move("A", coordinates, direction)))
+        benchmarks.append(Benchmark("count_consecutive_%s" % direction,
+                                    lambda game=game, coordinates=coordinates, direction=direction:
+                                    game.count_consecutive(coordinates, direction)))
+
+        def make_and_unmake(game=game, coordinates=coordinates, direction=direction):
+            game.make_move("A", coordinates, direction)
+            game.unmake_move()
+
+        benchmarks.append(Benchmark("make_unmake_%s" % direction, make_and_unmake))
+    return benchmarks
+
+
+def compare(results, baseline, threshold):
+    """
+    Takes the results, the baseline results and the allowed relative slowdown.
+    Returns the names of the benchmarks that are slower than the baseline by more than the threshold.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result["ops_per_sec"] < baseline[name]["ops_per_sec"] * (1 - threshold):
+            regressions.append(name)
+    return regressions
+
+
+def run_scaling(sizes, only=None, min_time=0.2):
+    """
+    Takes the board sizes, the names of the benchmarks to run (None for all) and the seconds per
+    timing repeat. Prints the nanoseconds per op of every scaling benchmark for every size and
+    the growth from the smallest size to the largest.
+    """
+    timings = {}
+    for size in sizes:
+        for benchmark in get_scaling_benchmarks(size):
+            if only and benchmark.name not in only:
+                continue
+            result = benchmark.measure(min_time)
+            timings.setdefault(benchmark.name, []).append(1e9 / result["ops_per_sec"])
+    print("%-22s" % "ns/op" + "".join("%10s" % ("N=%d" % size) for size in sizes) + "%10s" % "growth")
+    for name, nanoseconds in timings.items():
+        print("%-22s" % name + "".join("%10.0f" % value for value in nanoseconds)
+              + "%9.1fx" % (nanoseconds[-1] / nanoseconds[0]))
+    print("line length grows %.1fx" % (sizes[-1] / sizes[0]))
+
+
+def main(argv=None):
+    """
+    Takes the command line arguments. Runs the suite, prints a report and compares it with the
+    baseline, or runs the scaling benchmarks with --scaling. Returns 1 if there are regressions,
+    otherwise 0.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the KubaGame hot paths.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown")
+    parser.add_argument("--only", nargs="*", help="names of the benchmarks to run")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing repeat")
+    parser.add_argument("--scaling", action="store_true", help="time the line paths on growing boards")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SCALING_SIZES, help="board sizes for --scaling")
+    args = parser.parse_args(argv)
+
+    if args.scaling:
+        run_scaling(sorted(args.sizes), args.only, args.min_time)
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    results = {}
+    print("%-26s %14s %12s %10s" % ("benchmark", "ops/sec", "alloc bytes", "vs base"))
+    for benchmark in get_benchmarks():
+        if args.only and benchmark.name not in args.only:
+            continue
+        result = benchmark.measure(args.min_time)
+        results[benchmark.name] = result
+        change = ""
+        if benchmark.name in baseline:
+            change = "%+.1f%%" % (100.0 * (result["ops_per_sec"] / baseline[benchmark.name]["ops_per_sec"] - 1))
+        print("%-26s %14.1f %12d %10s" % (benchmark.name, result["ops_per_sec"], result["alloc_bytes"], change))
+
+    regressions = compare(results, baseline, args.threshold)
+    for name in regressions:
+        print("REGRESSION: %s is more than %d%% slower than the baseline" % (name, 100 * args.threshold))
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+# Description: Implementation of the KubaBitboard class. KubaBitboard plays the same Kuba Game as
+# KubaGame but stores the board as one 49-bit integer mask per marble color (W, B, R). Square
+# (row, column) is bit row * 7 + column, so a push is a shift of the masked run of marbles and
+# emptiness/push-off checks are single AND operations.
+
+# shift applied to a mask to move every marble one square along the direction
+_SHIFTS = {"R": 1, "L": -1, "B": 7, "F": -7}
+
+
+def _build_move_tables():
+    """
+    Precomputes, for every square and direction, the bit of the square, the bits strictly ahead
+    of it up to the edge, the edge bit a marble falls off from, and the preceding bit (0 at the edge).
+    """
+    tables = {}
+    for direction, shift in _SHIFTS.items():
+        row_step, column_step = {"R": (0, 1), "L": (0, -1), "B": (1, 0), "F": (-1, 0)}[direction]
+        for row in range(7):
+            for column in range(7):
+                ahead = 0
+                edge = 0
+                next_row, next_column = row + row_step, column + column_step
+                while 0 <= next_row < 7 and 0 <= next_column < 7:
+                    edge = 1 << (7 * next_row + next_column)
+                    ahead |= edge
+                    next_row, next_column = next_row + row_step, next_column + column_step
+                preceding = 0
+                back_row, back_column = row - row_step, column - column_step
+                if 0 <= back_row < 7 and 0 <= back_column < 7:
+                    preceding = 1 << (7 * back_row + back_column)
+                tables[(row, column, direction)] = (1 << (7 * row + column), ahead, edge, preceding, shift)
+    return tables
+
+
+_MOVE_TABLES = _build_move_tables()
+
+
+def _mask_from_rows(rows, marble):
+    """
+    Takes a list of rows (each a list or string of marbles) and a marble.
+    Returns the bit mask of the squares holding that marble.
+    """
+    mask = 0
+    for row_index, row in enumerate(rows):
+        for column_index, square in enumerate(row):
+            if square == marble:
+                mask |= 1 << (7 * row_index + column_index)
+    return mask
+
+
+class KubaBitboard:
+    """
+    The class representing the Kuba game on bitboards. Public methods match KubaGame.
+    """
+    def __init__(self, *args):
+        """
+        Initializes game with two tuples (player name, color chosen) and initializes the board.
+        """
+        playerList = []
+        for arg in args:
+            playerList += list(arg)
+        self._nameA = playerList[0]
+        self._nameB = playerList[2]
+        self._colorA = playerList[1]
+        self._colorB = playerList[3]
+
+        self._state = "UNFINISHED"
+        self._current_turn = None
+        self._nameA_red = 0
+        self._nameB_red = 0
+        self._pushed_off = None
+        # the position (W, B, R) before the last move that was not rolled back, i.e. the board
+        # a move must not recreate. None until the first move is attempted.
+        self._last_position = None
+
+        start = [
+            "WWXXXBB",
+            "WWXRXBB",
+            "XXRRRXX",
+            "XRRRRRX",
+            "XXRRRXX",
+            "BBXRXWW",
+            "BBXXXWW",
+        ]
+        self._white = _mask_from_rows(start, "W")
+        self._black = _mask_from_rows(start, "B")
+        self._red = _mask_from_rows(start, "R")
+
+    def get_pushed_off(self):
+        """
+        Returns the self._pushed_off marble
+        """
+        return self._pushed_off
+
+    def get_opponent(self, playerName):
+        """
+        Takes a player name and returns the opponent of the player.
+        """
+        if playerName == self._nameA:
+            return self._nameB
+        if playerName == self._nameB:
+            return self._nameA
+        return None
+
+    def get_color(self, playerName):
+        """
+        Takes a player name and returns the color chosen by the player.
+        """
+        if playerName == self._nameA:
+            return self._colorA
+        if playerName == self._nameB:
+            return self._colorB
+
+    def get_name_from_color(self, color):
+        """
+        Takes a color and returns the name of the matching player.
+        """
+        if color == self._colorA:
+            return self._nameA
+        return self._nameB
+
+    def get_A(self):
+        """
+        Returns the name and color info of player A
+        """
+        return self._nameA, self._colorA
+
+    def get_B(self):
+        """
+        Returns the name and color info of player B
+        """
+        return self._nameB, self._colorB
+
+    def get_current_turn(self):
+        """
+        Returns the player name whose turn it is to play the game.
+        Returns None if called when no player has made the first move.
+        """
+        return self._current_turn
+
+    def get_position(self):
+        """
+        Returns the board as a tuple of the (W, B, R) bit masks.
+        """
+        return self._white, self._black, self._red
+
+    def _color_at(self, bit):
+        """
+        Takes a single-bit mask. Returns the marble on that square, or 'X' if it is empty.
+        """
+        if self._white & bit:
+            return "W"
+        if self._black & bit:
+            return "B"
+        if self._red & bit:
+            return "R"
+        return "X"
+
+    def validate_move(self, playerName, coordinates, direction):
+        """
+        Takes a player name, coordinates and direction.
+        Checks the move against game rules.
+        Returns True if the move is valid, False if the move is invalid.
+        """
+        if self.get_winner() is not None:
+            return False
+        if direction not in ('B', 'F', 'L', 'R'):
+            return False
+        if not playerName:
+            return False
+        try:
+            row, column = coordinates
+        except (TypeError, ValueError):
+            return False
+        # other numbers, such as 1.0 or True, hash like the ints but are not coordinates
+        if type(row) is not int or type(column) is not int:
+            return False
+        table = _MOVE_TABLES.get((row, column, direction))
+        if table is None:
+            return False
+        if self._current_turn is not None and playerName != self._current_turn:
+            return False
+
+        bit, ahead, edge, preceding, shift = table
+        if self._color_at(bit) != self.get_color(playerName):
+            return False
+        # cannot push towards the edge the marble is standing on
+        if not ahead:
+            return False
+        # the square the push comes from must be the edge of the board or empty
+        if (self._white | self._black | self._red) & preceding:
+            return False
+        return True
+
+    def _push(self, table):
+        """
+        Takes the move table entry of a validated move and pushes the run of marbles starting at
+        the square one square along the direction. Sets self._pushed_off to the marble pushed off
+        the board, if any.
+        """
+        bit, ahead, edge, preceding, shift = table
+        white, black, red = self._white, self._black, self._red
+        ray = bit | ahead
+        empty_ahead = ahead & ~(white | black | red)
+
+        if empty_ahead:
+            # the run stops before the nearest vacant square
+            if shift > 0:
+                gap = empty_ahead & -empty_ahead
+                run = (gap - 1) & ray
+            else:
+                gap = 1 << (empty_ahead.bit_length() - 1)
+                run = ray & ~((gap << 1) - 1)
+        else:
+            # the whole ray is full: the marble on the edge falls off
+            if white & edge:
+                self._pushed_off = "W"
+            elif black & edge:
+                self._pushed_off = "B"
+            else:
+                self._pushed_off = "R"
+            white &= ~edge
+            black &= ~edge
+            red &= ~edge
+            run = ray & ~edge
+
+        if shift > 0:
+            self._white = (white & ~run) | ((white & run) << shift)
+            self._black = (black & ~run) | ((black & run) << shift)
+            self._red = (red & ~run) | ((red & run) << shift)
+        else:
+            shift = -shift
+            self._white = (white & ~run) | ((white & run) >> shift)
+            self._black = (black & ~run) | ((black & run) >> shift)
+            self._red = (red & ~run) | ((red & run) >> shift)
+
+    def make_move(self, playerName, coordinates, direction):
+        """
+        Takes playerName, coordinates, and direction.
+        Returns True if the move is valid and successful.
+        Returns False if the move is invalid or unsuccessful.
+        Updates captures, turn, game state.
+        """
+        before = (self._white, self._black, self._red)
+        last_position = self._last_position
+
+        if not self.validate_move(playerName, coordinates, direction):
+            self._last_position = before
+            self._pushed_off = None
+            return False
+
+        self._push(_MOVE_TABLES[(coordinates[0], coordinates[1], direction)])
+
+        # cannot push off your own marble
+        if self._pushed_off is not None and self._pushed_off == self.get_color(playerName):
+            self._white, self._black, self._red = before
+            self._pushed_off = None
+            return False
+
+        # cannot undo the opponent's last move
+        if last_position is not None and (self._white, self._black, self._red) == last_position:
+            self._white, self._black, self._red = before
+            return False
+
+        self._last_position = before
+        if self._pushed_off == "R":
+            if playerName == self._nameA:
+                self._nameA_red += 1
+            elif playerName == self._nameB:
+                self._nameB_red += 1
+
+        self._current_turn = self.get_opponent(playerName)
+        self._pushed_off = None
+        self.get_winner()
+        return True
+
+    def get_winner(self):
+        """
+        Returns the name of the winning player.
+        Returns None if no winner yet.
+        If there is a winner, changes game_state to "FINISHED".
+        """
+        if self._nameA_red == 7:
+            self._state = "FINISHED"
+            return self._nameA
+        elif self._nameB_red == 7:
+            self._state = "FINISHED"
+            return self._nameB
+        elif not self._white:
+            self._state = "FINISHED"
+            return self.get_name_from_color("B")
+        elif not self._black:
+            self._state = "FINISHED"
+            return self.get_name_from_color("W")
+        return None
+
+    def get_size(self):
+        """
+        Returns the number of rows (and columns) of the board, which is always 7.
+        """
+        return 7
+
+    def get_red_to_win(self):
+        """
+        Returns the number of red marbles a player must push off to win, which is always 7.
+        """
+        return 7
+
+    def get_captured(self, playerName):
+        """
+        Takes a playerName. Returns how many Red marbles have been captured by this player.
+        """
+        if playerName == self._nameA:
+            return self._nameA_red
+        elif playerName == self._nameB:
+            return self._nameB_red
+
+    def get_marble(self, coordinates):
+        """
+        Takes coordinates.
+        Returns the marble that is present at the coordinates position.
+        Returns 'X' if no marble at the location.
+        """
+        return self._color_at(1 << (7 * coordinates[0] + coordinates[1]))
+
+    def get_marble_count(self):
+        """
+        Returns the number of marbles currently on the board,
+        in the following order: White, Black, and Red as tuple (W,B,R).
+        """
+        return self._white.bit_count(), self._black.bit_count(), self._red.bit_count()
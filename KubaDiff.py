@@ -0,0 +1,263 @@
+# Description: Differential checking harness between the reference KubaGame and a faster engine with the same
+# public methods, such as KubaBitboard. Both engines are driven with the same seeded random move stream (mostly
+# moves of the player's own marbles, with a share of invalid ones: wrong player, wrong square, off the board,
+# bad direction) and compared after every move on the make_move result, board, turn, red captures, the marble
+# pushed off by the move (taken from the change in each engine's marble count, as get_pushed_off is reset once a
+# move is made) and winner. A mismatch is shrunk by delta debugging to a minimal move sequence that still reproduces
+# it; only the first failures of each chunk are shrunk, within a budget of replays. Seeds are checked in
+# chunks across worker processes, so millions of moves can be run.
+#
+# Usage: python KubaDiff.py [MODULE.CLASS] [--seeds N] [--steps S] [--workers W] [--invalid-rate P]
+import argparse
+import importlib
+import random
+import sys
+import time
+
+from KubaGame import KubaGame
+from KubaSelfPlay import PLAYERS, run_bounded
+
+DIRECTIONS = "BFLR"
+
+
+def get_state(game):
+    """
+    Takes a game. Returns the state the engines are compared on: the board rows, the turn,
+    each player's red captures and the winner.
+    """
+    size = game.get_size()
+    board = tuple("".join(game.get_marble((row, column)) for column in range(size)) for row in range(size))
+    names = (game.get_A()[0], game.get_B()[0])
+    return (board, game.get_current_turn(), game.get_captured(names[0]), game.get_captured(names[1]),
+            game.get_winner())
+
+
+def get_pushed_off(before, after):
+    """
+    Takes the (W,B,R) marble counts of a game before and after a move.
+    Returns the marble the move pushed off the board, or None if it pushed none off.
+    """
+    for color, count_before, count_after in zip("WBR", before, after):
+        if count_after < count_before:
+            return color
+    return None
+
+
+def apply_move(game, move):
+    """
+    Takes a game and a (playerName, coordinates, direction) move.
+    Makes the move. Returns the result of make_move, or the name of the exception it raised.
+    """
+    try:
+        return game.make_move(*move)
+    except Exception as error:
+        return type(error).__name__
+
+
+def get_random_move(game, rng, invalid_rate):
+    """
+    Takes the reference game, a random.Random and the share of invalid moves.
+    Returns a random (playerName, coordinates, direction): mostly a marble of the player to move,
+    otherwise a move by the wrong player, from any square, off the board or in a bad direction.
+    """
+    size = game.get_size()
+    names = (game.get_A()[0], game.get_B()[0])
+    playerName = game.get_current_turn() or rng.choice(names)
+    if rng.random() < invalid_rate:
+        kind = rng.randrange(4)
+        if kind == 0:
+            return rng.choice(names + ("nobody",)), (rng.randrange(size), rng.randrange(size)), rng.choice(DIRECTIONS)
+        if kind == 1:
+            return playerName, (rng.randrange(size), rng.randrange(size)), rng.choice(DIRECTIONS)
+        if kind == 2:
+            return playerName, (rng.randrange(-1, size + 2), rng.randrange(-1, size + 2)), rng.choice(DIRECTIONS)
+        return playerName, (rng.randrange(size), rng.randrange(size)), rng.choice("XbF ")
+    color = game.get_color(playerName)
+    squares = [(row, column) for row in range(size) for column in range(size)
+               if game.get_marble((row, column)) == color]
+    if len(squares) == 0:
+        squares = [(rng.randrange(size), rng.randrange(size))]
+    return playerName, rng.choice(squares), rng.choice(DIRECTIONS)
+
+
+def compare(reference, candidate, move):
+    """
+    Takes the two engines and a move. Makes the move on both.
+    Returns None if they agree afterwards, otherwise a dict with what each of them gave.
+    """
+    reference_count = reference.get_marble_count()
+    candidate_count = candidate.get_marble_count()
+    expected = apply_move(reference, move)
+    found = apply_move(candidate, move)
+    if expected != found:
+        return {"what": "make_move", "expected": expected, "found": found}
+    expected = get_pushed_off(reference_count, reference.get_marble_count())
+    found = get_pushed_off(candidate_count, candidate.get_marble_count())
+    if expected != found:
+        return {"what": "pushed_off", "expected": expected, "found": found}
+    expected = get_state(reference)
+    found = get_state(candidate)
+    if expected != found:
+        return {"what": "state", "expected": expected, "found": found}
+    return None
+
+
+def run_stream(candidate_class, seed, steps, invalid_rate, reference_class=KubaGame):
+    """
+    Takes the engine class to check, a seed, the most moves, the share of invalid moves and the
+    reference class. Plays the seeded random move stream on both engines until the game is won, the
+    steps run out or they disagree. Returns the moves played and the index of the move they first
+    disagree after (None if they agree throughout) with the mismatch.
+    """
+    rng = random.Random(seed)
+    reference = reference_class(*PLAYERS)
+    candidate = candidate_class(*PLAYERS)
+    moves = []
+    for step in range(steps):
+        move = get_random_move(reference, rng, invalid_rate)
+        moves.append(move)
+        mismatch = compare(reference, candidate, move)
+        if mismatch is not None:
+            return moves, step, mismatch
+        if reference.get_winner() is not None:
+            break
+    return moves, None, None
+
+
+def find_mismatch(candidate_class, moves, reference_class=KubaGame):
+    """
+    Takes the engine class to check, a list of moves and the reference class.
+    Replays the moves on new games of both. Returns the index of the first move they disagree
+    after and the mismatch, or (None, None).
+    """
+    reference = reference_class(*PLAYERS)
+    candidate = candidate_class(*PLAYERS)
+    for index, move in enumerate(moves):
+        mismatch = compare(reference, candidate, move)
+        if mismatch is not None:
+            return index, mismatch
+    return None, None
+
+
+def shrink(candidate_class, moves, reference_class=KubaGame, max_tests=1000):
+    """
+    Takes the engine class to check, a list of moves on which it disagrees with the reference,
+    the reference class and the most replays to try.
+    Returns a sublist of the moves that still makes them disagree, from which no single move can be
+    removed (delta debugging, ddmin), or the shortest one found when the replays run out.
+    """
+    index = find_mismatch(candidate_class, moves, reference_class)[0]
+    moves = list(moves[:index + 1])
+    tests = 0
+
+    def fails(sequence):
+        return find_mismatch(candidate_class, sequence, reference_class)[0] is not None
+
+    # most random moves are rejected and only matter through the board they make ko compare
+    # against, so first try without all of them at once
+    reference = reference_class(*PLAYERS)
+    accepted = [move for move in moves if apply_move(reference, move) is True]
+    if len(accepted) < len(moves) and fails(accepted):
+        index = find_mismatch(candidate_class, accepted, reference_class)[0]
+        moves = accepted[:index + 1]
+
+    chunks = 2
+    while len(moves) >= 2 and tests < max_tests:
+        size = -(-len(moves) // chunks)
+        reduced = False
+        for start in range(0, len(moves), size):
+            if tests == max_tests:
+                break
+            tests += 1
+            complement = moves[:start] + moves[start + size:]
+            if fails(complement):
+                moves = complement
+                chunks = max(chunks - 1, 2)
+                reduced = True
+                break
+        if not reduced:
+            if chunks >= len(moves):
+                break
+            chunks = min(chunks * 2, len(moves))
+    # the mismatch may now show up before the last move
+    index = find_mismatch(candidate_class, moves, reference_class)[0]
+    return moves[:index + 1]
+
+
+def check_seeds(candidate_class, start, count, steps, invalid_rate, reference_class=KubaGame, max_shrunk=1):
+    """
+    Takes the engine class to check, the first seed, the number of seeds, the most moves per
+    stream, the share of invalid moves, the reference class and how many failures to shrink.
+    Runs the stream of every seed. Returns the number of moves made and a list of failures, each
+    with the seed, the moves up to the mismatch (shrunk for the first max_shrunk failures),
+    whether they were shrunk and the mismatch they end with. Runs in a worker process.
+    """
+    made = 0
+    failures = []
+    for seed in range(start, start + count):
+        moves, index, mismatch = run_stream(candidate_class, seed, steps, invalid_rate, reference_class)
+        made += len(moves)
+        if mismatch is not None:
+            shrunk = len(failures) < max_shrunk
+            if shrunk:
+                moves = shrink(candidate_class, moves, reference_class)
+                mismatch = find_mismatch(candidate_class, moves, reference_class)[1]
+            failures.append({"seed": seed, "moves": moves, "shrunk": shrunk, "mismatch": mismatch})
+    return made, failures
+
+
+def run_diff(candidate_class, seeds=1000, steps=500, workers=None, chunk_size=50, invalid_rate=0.1,
+             reference_class=KubaGame, max_shrunk=1):
+    """
+    Takes the engine class to check, the number of seeds, the most moves per seed, the number of
+    worker processes, the seeds per chunk, the share of invalid moves, the reference class and how
+    many failures to shrink per chunk.
+    Checks every seed across the workers. Returns a dict with the moves made, the failures in
+    seed order, the seconds taken and the moves/sec.
+    """
+    start = time.perf_counter()
+    made = 0
+    failures = []
+    chunks = ((candidate_class, first, min(chunk_size, seeds - first), steps, invalid_rate, reference_class,
+               max_shrunk) for first in range(0, seeds, chunk_size))
+    for chunk_made, chunk_failures in run_bounded(check_seeds, chunks, workers):
+        made += chunk_made
+        failures += chunk_failures
+    seconds = time.perf_counter() - start
+    return {"moves": made, "failures": failures, "seconds": seconds,
+            "moves_per_sec": made / seconds if seconds else 0.0}
+
+
+def main(argv=None):
+    """
+    Takes the command line arguments. Checks an engine against KubaGame and prints the failures.
+    Returns 1 if the engines disagree, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(description="Check a Kuba engine against KubaGame on random move streams.")
+    parser.add_argument("engine", nargs="?", default="KubaBitboard.KubaBitboard", help="MODULE.CLASS to check")
+    parser.add_argument("--seeds", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=500, help="most moves per seed")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--invalid-rate", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    module_name, class_name = args.engine.rsplit(".", 1)
+    candidate_class = getattr(importlib.import_module(module_name), class_name)
+    result = run_diff(candidate_class, args.seeds, args.steps, args.workers, invalid_rate=args.invalid_rate)
+    for failure in result["failures"]:
+        print("seed %d: %d %smoves reproduce a %s mismatch" % (
+            failure["seed"], len(failure["moves"]), "" if failure["shrunk"] else "unshrunk ",
+            failure["mismatch"]["what"]))
+        if not failure["shrunk"]:
+            continue
+        for move in failure["moves"]:
+            print("    make_move%r" % (move,))
+        print("    expected %r" % (failure["mismatch"]["expected"],))
+        print("    found    %r" % (failure["mismatch"]["found"],))
+    print("%d moves in %.2fs (%.0f moves/sec), %d failing seeds" % (
+        result["moves"], result["seconds"], result["moves_per_sec"], len(result["failures"])))
+    return 1 if result["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
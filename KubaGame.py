@@ -1,16 +1,145 @@
 # Author: Jin Huang
 # Description: Implementation of the KubaGame class. Kuba Game is a marble game that takes two players.
 # Each player has 8 marbles (B,W) and the game has 13 neutral red marbles. If a player pushes off
-# 7 red marbles or s/he pushes off all opponent's marbles, the player wins.
-import copy
+# 7 red marbles or s/he pushes off all opponent's marbles, the player wins. Larger or smaller square
+# boards can be played too: a player then wins by pushing off more than half of the red marbles.
+import random
+from collections import namedtuple
+
+def _build_zobrist_tables(size):
+    """
+    Takes the board size.
+    Returns the Zobrist keys of the size: one random 64-bit number per (square, marble), then one per
+    color of the player to move and one per color and red capture count. The hash of a board is the XOR
+    of the keys of its marbles, so a push updates it by XOR-ing only the squares it changes. Empty
+    squares have key 0.
+    """
+    rng = random.Random(size)
+    squares = [[{"W": rng.getrandbits(64), "B": rng.getrandbits(64), "R": rng.getrandbits(64), "X": 0}
+                for column in range(size)] for row in range(size)]
+    turn = {"W": rng.getrandbits(64), "B": rng.getrandbits(64), None: 0}
+    captures = {color: [rng.getrandbits(64) for count in range(size * size + 1)] for color in ("W", "B")}
+    return squares, turn, captures
+
+
+def _build_line_tables(size):
+    """
+    Takes the board size.
+    Returns a dict mapping (row, column, direction) of every square and direction to
+    (ray, preceding, edge_ahead): the squares ahead of the square along the direction, nearest
+    first, the square preceding it (None on the edge behind) and whether it is on the edge ahead.
+    """
+    steps = {'B': (1, 0), 'F': (-1, 0), 'L': (0, -1), 'R': (0, 1)}
+    # one tuple per square, shared by every ray through it
+    squares = [[(row, column) for column in range(size)] for row in range(size)]
+    tables = {}
+    for row in range(size):
+        for column in range(size):
+            for direction, (row_step, column_step) in steps.items():
+                ray = []
+                row_ahead = row + row_step
+                column_ahead = column + column_step
+                while 0 <= row_ahead < size and 0 <= column_ahead < size:
+                    ray.append(squares[row_ahead][column_ahead])
+                    row_ahead += row_step
+                    column_ahead += column_step
+                preceding = None
+                if 0 <= row - row_step < size and 0 <= column - column_step < size:
+                    preceding = squares[row - row_step][column - column_step]
+                tables[(row, column, direction)] = (tuple(ray), preceding, len(ray) == 0)
+    return tables
+
+
+def _build_run_tables(size):
+    """
+    Takes the board size.
+    Returns a dict mapping (row, column, direction) of every square and direction to
+    (line, position, ahead_mask, forward): the line of the occupancy index the direction moves
+    along (rows are 0 to size-1, columns size to 2*size-1), the bit of the square in that line,
+    the mask of the bits ahead of it and whether ahead is towards the higher bits.
+    """
+    full = (1 << size) - 1
+    tables = {}
+    for row in range(size):
+        for column in range(size):
+            for direction in ('B', 'F', 'L', 'R'):
+                if direction in ('L', 'R'):
+                    line, position = row, column
+                else:
+                    line, position = size + column, row
+                forward = direction in ('B', 'R')
+                if forward:
+                    ahead_mask = full & ~((1 << (position + 1)) - 1)
+                else:
+                    ahead_mask = (1 << position) - 1
+                tables[(row, column, direction)] = (line, position, ahead_mask, forward)
+    return tables
+
+
+MoveEvent = namedtuple("MoveEvent", ["player", "coordinates", "direction", "cells", "pushed_off", "captured",
+                                     "turn", "winner", "undo", "rejected"])
+MoveEvent.__doc__ = """
+A change of a game, sent to its observers: the player, coordinates and direction of the move, the
+changed cells as (row, column, marble now there) tuples, the marble pushed off (None if none; on undo,
+the marble put back), the red captures by player name, the player to move next, the winner, whether
+the move was taken back by unmake_move rather than made, and whether it was a make_move call that
+validate_move rejected. A rejected call changes no cells, but the board before it is still kept for
+the ko rule.
+"""
+
+MIN_SIZE = 3                    # smallest board whose start layout has W, B and R marbles
+MAX_SIZE = 255                  # largest board a KubaRecord header can hold
+
+# the tables of each board size, built the first time a game of the size is created, so that validation
+# and counting are lookups instead of per-direction branches
+_SIZE_TABLES = {}
+
+
+def _get_size_tables(size):
+    """
+    Takes the board size. Returns its (Zobrist square keys, Zobrist turn keys, Zobrist capture keys,
+    line tables, run tables).
+    """
+    if size not in _SIZE_TABLES:
+        _SIZE_TABLES[size] = _build_zobrist_tables(size) + (_build_line_tables(size), _build_run_tables(size))
+    return _SIZE_TABLES[size]
+
+
+def get_start_board(size=7):
+    """
+    Takes the board size.
+    Returns the default layout as a 2d list of marbles: blocks of size // 3 by size // 3 W marbles in
+    the top left and bottom right corners and B marbles in the other two, and a diamond of R marbles
+    of radius (size - 1) // 3 around the center. The 7x7 layout is the standard board with 13 reds.
+    """
+    block = size // 3
+    radius = (size - 1) // 3
+    center = size // 2
+    board = [["X"] * size for row in range(size)]
+    for row in range(size):
+        for column in range(size):
+            if abs(row - center) + abs(column - center) <= radius:
+                board[row][column] = "R"
+            elif row < block and column < block or row >= size - block and column >= size - block:
+                board[row][column] = "W"
+            elif row < block and column >= size - block or row >= size - block and column < block:
+                board[row][column] = "B"
+    return board
+
 
 class KubaGame:
     """
     The class representing the Kuba game.
     """
-    def __init__(self, *args):
+    def __init__(self, *args, debug=False, size=None, board=None):
         """
         Initializes game with two tuples (player name, color chosen) and initializes the board.
+        The board is size x size (7x7 if no size is given) with the get_start_board layout, or the given
+        layout, a square 2d list of marbles. A player wins by pushing off more than half of the red
+        marbles of the layout. Raises ValueError if both a size and a layout of another size are given,
+        if the size is not from MIN_SIZE to MAX_SIZE, or if the layout has no W or no B marbles.
+        If debug is True, every get_marble_count cross-checks the running marble counts against
+        a full scan of the board.
         """
 
         # unpack the input tuple to retreive player names and colors chosen.
@@ -31,20 +160,92 @@ class KubaGame:
         self._is_valid = None                   # flag if a move is valid
         self._pushed_off = None                   # the marble that would be pushed off
         self._valid_direction =['B','F','L','R']      # a list of valid directions
-        self._pre_opponent_move = []            # a list of copies of the board before opponent's moves.
-
-        # board is a 7x7 2d list, each element of the list has a character that represents the color of the marble
-        # "X" represents an empty space
+        self._pre_opponent_move = []            # a list of hashes of the board before opponent's moves.
+        self._move_records = None               # delta records of the moves made, for unmake_move, as a linked
+                                                # list of (record, previous records) pairs that forks can share
+        self._history_shared = False            # if _pre_opponent_move is shared with a fork, copy before writing
+        self._squares_shared = False            # if _marble_squares is shared with a fork, copy before writing
+        self._debug = debug                     # cross-check running counts against the board
+        self._observers = []                    # callables sent a MoveEvent for every move made or taken back
+
+        # board is a size x size 2d list, each element of the list has a character that represents the color
+        # of the marble. "X" represents an empty space
+        if board is None:
+            if size is not None and (type(size) is not int or not MIN_SIZE <= size <= MAX_SIZE):
+                raise ValueError("the size must be an int from %d to %d, not %r" % (MIN_SIZE, MAX_SIZE, size))
+            board = get_start_board(7 if size is None else size)
+        elif size is not None and len(board) != size:
+            raise ValueError("the board has %d rows, not %d" % (len(board), size))
+        if not MIN_SIZE <= len(board) <= MAX_SIZE:
+            raise ValueError("the board must have from %d to %d rows, not %d" % (MIN_SIZE, MAX_SIZE, len(board)))
+        self._size = len(board)
+        (self._zobrist_squares, self._zobrist_turn, self._zobrist_captures,
+         self._line_tables, self._run_tables) = _get_size_tables(self._size)
         # initializes the board
-        self._board = [
-            ["W", "W", "X", "X", "X", "B", "B"],
-            ["W", "W", "X", "R", "X", "B", "B"],
-            ["X", "X", "R", "R", "R", "X", "X"],
-            ["X", "R", "R", "R", "R", "R", "X"],
-            ["X", "X", "R", "R", "R", "X", "X"],
-            ["B", "B", "X", "R", "X", "W", "W"],
-            ["B", "B", "X", "X", "X", "W", "W"]
-        ]
+        self.set_board(board)
+        if self._marble_count["W"] == 0 or self._marble_count["B"] == 0:
+            raise ValueError("the board must have W and B marbles")
+        self._red_to_win = self._marble_count["R"] // 2 + 1     # 7 of the 13 reds on the 7x7 board
+
+    def set_board(self, board):
+        """
+        Takes a board as a 2d list of marbles of the game's size and puts a copy of it on the game.
+        Recomputes the running marble counts, the board hash, the players' marble squares and
+        the occupancy index from it. Turn, captures and move history are left as they are.
+        Raises ValueError if the board is not of the game's size.
+        """
+        size = self._size
+        if len(board) != size or any(len(row) != size for row in board):
+            raise ValueError("the board must be %d x %d" % (size, size))
+        self._board = [list(row) for row in board]
+        self._shared_rows = [False] * size      # rows shared with a fork are copied before they are written
+
+        # running count of each marble on the board, only changed when a marble is pushed off
+        self._marble_count = dict(zip(("W", "B", "R"), self.count_marbles()))
+
+        # Zobrist hash of the board, kept up to date by every push
+        self._board_hash = 0
+        for row in range(0,size):
+            for column in range(0,size):
+                self._board_hash ^= self._zobrist_squares[row][column][self._board[row][column]]
+
+        # squares holding each player's marbles, i.e. the candidate squares a move can start from.
+        # updated incrementally from the pushed row or column after each move.
+        self._marble_squares = {"W": set(), "B": set()}
+        self._squares_shared = False
+        for row in range(0,size):
+            for column in range(0,size):
+                if self._board[row][column] in self._marble_squares:
+                    self._marble_squares[self._board[row][column]].add((row, column))
+
+        # occupancy index: one size-bit mask of the occupied squares per row (0 to size-1) and per
+        # column (size to 2*size-1), so that runs of marbles and the gaps between them are found
+        # without scanning the board
+        self._occupancy = [0] * (2 * size)
+        for row in range(0,size):
+            for column in range(0,size):
+                if self._board[row][column] != "X":
+                    self._occupancy[row] |= 1 << column
+                    self._occupancy[size + column] |= 1 << row
+
+    def set_position(self, board, playerName, captured):
+        """
+        Takes a board as a 2d list of marbles of the game's size, the name of the player to move (None if either
+        player may move) and a dict of the red marbles captured by each player name.
+        Puts the position on the game as if it had just been reached: there are no moves to take
+        back and no earlier boards to compare with.
+        """
+        self.set_board(board)
+        self._current_turn = playerName
+        self._nameA_red = captured.get(self._nameA, 0)
+        self._nameB_red = captured.get(self._nameB, 0)
+        self._pre_opponent_move = []
+        self._history_shared = False
+        self._move_records = None
+        self._state = "UNFINISHED"
+        self._is_valid = None
+        self._pushed_off = None
+        self.get_winner()
 
     def get_pushed_off(self):
         """
@@ -54,9 +255,38 @@ class KubaGame:
 
     def get_pre_oppo_move(self):
         """Returns the self._pre_opponent_move list that contains
-        the copies of the board before an opponent's move. """
+        the hashes of the board before an opponent's move. """
         return self._pre_opponent_move
 
+    def get_size(self):
+        """
+        Returns the number of rows (and columns) of the board.
+        """
+        return self._size
+
+    def get_red_to_win(self):
+        """
+        Returns the number of red marbles a player must push off to win.
+        """
+        return self._red_to_win
+
+    def get_board_hash(self):
+        """
+        Returns the Zobrist hash of the marbles on the board.
+        """
+        return self._board_hash
+
+    def position_hash(self):
+        """
+        Returns a Zobrist hash of the position: the board, the color of the player to move and
+        each color's red captures. Equal positions of any two games have equal hashes, so it
+        can be used as a cache key.
+        """
+        return (self._board_hash
+                ^ self._zobrist_turn[self.get_color(self._current_turn)]
+                ^ self._zobrist_captures[self._colorA][self._nameA_red]
+                ^ self._zobrist_captures[self._colorB][self._nameB_red])
+
     def get_opponent(self, playerName):
         """
         Takes a player name and returns the opponent of the player.
@@ -124,43 +354,140 @@ class KubaGame:
         Takes row index, column index, and marble (W,B,R).
         Assigns the marble to the corresponding board position.
         """
+        if self._shared_rows[row_index]:
+            # the row is shared with a fork: copy it before writing
+            self._board[row_index] = list(self._board[row_index])
+            self._shared_rows[row_index] = False
         self._board[row_index][column_index] = marble
 
+    def put_row(self, row_index, row):
+        """
+        Takes row index and a new list of marbles. Replaces the row of the board with it.
+        """
+        self._board[row_index] = row
+        self._shared_rows[row_index] = False
+
+    def get_line(self, coordinates, direction):
+        """
+        Takes coordinates and direction.
+        Returns the squares of the row (L, R) or column (F, B) a push from the coordinates moves along.
+        """
+        if direction in ("L", "R"):
+            return [(self.get_x(coordinates), column) for column in range(0,self._size)]
+        return [(row, self.get_y(coordinates)) for row in range(0,self._size)]
+
+    def get_line_changes(self, line, line_before):
+        """
+        Takes the squares of a line and the marbles that were on them before a push.
+        Returns a list of (square, marble before, marble after) for the squares the push changed.
+        """
+        changes = []
+        for index in range(len(line)):
+            square = line[index]
+            marble = self._board[square[0]][square[1]]
+            if marble != line_before[index]:
+                changes.append((square, line_before[index], marble))
+        return changes
+
+    def undo_changes(self, changes):
+        """
+        Takes a list of (square, marble before, marble after) and puts the marbles before back on the board.
+        """
+        for square, before, after in changes:
+            self.place_marble(square[0], square[1], before)
+
+    def get_changes_hash(self, changes):
+        """
+        Takes a list of (square, marble before, marble after).
+        Returns the value to XOR into the board hash to apply the changes.
+        """
+        delta = 0
+        for square, before, after in changes:
+            keys = self._zobrist_squares[square[0]][square[1]]
+            delta ^= keys[before] ^ keys[after]
+        return delta
+
+    def update_marble_squares(self, changes):
+        """
+        Takes a list of (square, marble before, marble after) of a move that has been made.
+        Moves the changed squares between the players' marble squares.
+        """
+        if self._squares_shared:
+            self._marble_squares = {color: set(squares) for color, squares in self._marble_squares.items()}
+            self._squares_shared = False
+        for square, before, after in changes:
+            if before in self._marble_squares:
+                self._marble_squares[before].discard(square)
+            if after in self._marble_squares:
+                self._marble_squares[after].add(square)
 
     def count_consecutive(self, coordinates,direction):
         """
         Takes coordinates and a direction.
         Returns how many consecutive marbles are ahead of the marble at the coordinates
         along the given direction, i.e., stop counting if reaches a vacant square.
+        Returns None if there is no vacant square ahead.
         """
-        x_move = self.get_x(coordinates)
-        y_move = self.get_y(coordinates)
-        counter = 0
+        line, position, ahead_mask, forward = self._run_tables[(coordinates[0], coordinates[1], direction)]
+        vacant = ahead_mask & ~self._occupancy[line]
+        if vacant == 0:
+            return None
+        if forward:
+            # lowest vacant bit ahead
+            return (vacant & -vacant).bit_length() - position - 2
+        # highest vacant bit ahead
+        return position - vacant.bit_length()
 
-        if direction == "R":
-            for index in range(y_move+1,7):
-                if self.get_marble((x_move,index)) != "X":
-                    counter += 1
-                else:
-                    return counter
-        elif direction == "L":
-            for index in reversed(range(0,y_move)):
-                if self.get_marble((x_move,index)) != "X":
-                    counter += 1
-                else:
-                    return counter
-        elif direction == "B":
-            for row in range(x_move+1,7):
-                if self.get_marble((row,y_move)) != "X":
-                    counter += 1
-                else:
-                    return counter
-        elif direction == "F":
-            for row in reversed(range(0,x_move)):
-                if self.get_marble((row, y_move)) != "X":
-                    counter += 1
-                else:
-                    return counter
+    def update_occupancy(self, changes):
+        """
+        Takes a list of (square, marble before, marble after) of a move that has been made or taken back.
+        Flips the occupancy bits of the squares that were emptied or filled.
+        """
+        for square, before, after in changes:
+            if (before == "X") != (after == "X"):
+                self._occupancy[square[0]] ^= 1 << square[1]
+                self._occupancy[self._size + square[1]] ^= 1 << square[0]
+
+    def next_gap(self, coordinates, direction):
+        """
+        Takes coordinates and direction.
+        Returns the coordinates of the first vacant square ahead of the coordinates along the
+        direction, or None if every square up to the edge is occupied.
+        """
+        counter = self.count_consecutive(coordinates, direction)
+        if counter is None:
+            return None
+        return self._line_tables[(coordinates[0], coordinates[1], direction)][0][counter]
+
+    def get_push_off_marble(self, coordinates, direction):
+        """
+        Takes coordinates and direction of a move.
+        Returns the marble the move would push off the board, or None if it pushes nothing off.
+        """
+        ray = self._line_tables[(coordinates[0], coordinates[1], direction)][0]
+        if len(ray) == 0 or self.count_consecutive(coordinates, direction) is not None:
+            return None
+        return self._board[ray[-1][0]][ray[-1][1]]
+
+    def get_line_runs(self, coordinates, direction):
+        """
+        Takes coordinates and direction.
+        Returns the runs of consecutive marbles on the row (L, R) or column (F, B) through the
+        coordinates, as (first index, length) pairs in increasing index order, where the index is
+        the column of a row or the row of a column.
+        """
+        mask = self._occupancy[self._run_tables[(coordinates[0], coordinates[1], direction)][0]]
+        runs = []
+        index = 0
+        while mask:
+            skip = (mask & -mask).bit_length() - 1      # vacant squares before the run
+            mask >>= skip
+            index += skip
+            length = (~mask & (mask + 1)).bit_length() - 1  # occupied squares in the run
+            runs.append((index, length))
+            mask >>= length
+            index += length
+        return runs
 
     def push_right(self, coordinates, direction):
         """
@@ -187,12 +514,12 @@ class KubaGame:
             else:
                 first_part = this_row[:y_move]
             #traverse this row until the first vacant square is found
-            for index in range(y_move, 7):
+            for index in range(y_move, self._size):
                 if this_row[index] != "X":
                     second_part.append(this_row[index])
                 else:
                     break
-            third_part_length = 7 - len(first_part) - len(second_part) - 1
+            third_part_length = self._size - len(first_part) - len(second_part) - 1
             if third_part_length == 0:
                 third_part = []
             else:
@@ -205,12 +532,12 @@ class KubaGame:
             # partially shifted
             this_row = first_part + second_part_right_shift + third_part
             # inplace
-            self._board[x_move] = this_row
+            self.put_row(x_move, this_row)
 
         # no vacant square ahead of the move
         elif counter is None:
             # save the marble to be pushed off
-            self._pushed_off = self.get_marble((x_move, 6))
+            self._pushed_off = self.get_marble((x_move, self._size - 1))
 
             this_row = []  # new shifted row
             old_row = self._board[x_move]               #the original row
@@ -220,12 +547,9 @@ class KubaGame:
             row_second_half = old_row[y_move+1:]      #have the second half changed
             this_row = row_first_half + row_second_half
 
-            self._board[x_move] = this_row            #put the shifted row in place
+            self.put_row(x_move, this_row)            #put the shifted row in place
             self.place_marble(x_move, y_move, "X")  # replace the old position with empty square
 
-            # place the new row back on the board
-            self._board[x_move] = this_row
-
     def push_left(self, coordinates, direction):
         """
         Takes coordinates and direction.
@@ -243,10 +567,10 @@ class KubaGame:
             second_part_left_shift = []
             third_part = []
             this_row = self._board[x_move]
-            if y_move == 6:
+            if y_move == self._size - 1:
                 third_part = []
-            elif y_move == 5:
-                third_part.append(this_row[6])
+            elif y_move == self._size - 2:
+                third_part.append(this_row[self._size - 1])
             else:
                 third_part = this_row[y_move+1:]
             # traverse this row reversed until the first vacant square is found
@@ -255,7 +579,7 @@ class KubaGame:
                     second_part.append(this_row[index])
                 else:
                     break
-            first_part_length = 7 - len(third_part) - len(second_part) - 1
+            first_part_length = self._size - len(third_part) - len(second_part) - 1
             first_part = this_row[:first_part_length]
 
             for index in range(len(second_part)):
@@ -263,7 +587,7 @@ class KubaGame:
                 second_part_left_shift.append(this_marble)
             second_part_left_shift.append("X")
             this_row = first_part + second_part_left_shift + third_part
-            self._board[x_move] = this_row
+            self.put_row(x_move, this_row)
 
         # no vacant square ahead of the move
         elif counter is None:
@@ -277,8 +601,9 @@ class KubaGame:
             old_row = old_row[1:] + old_row[:1]         #shift all elements to the left by one position
             row_first_half = old_row[:y_move+1]         #have the first part changed
             shifted_row = row_first_half + row_second_half
+            shifted_row[y_move] = "X"                   # the pushed off marble does not wrap around
 
-            self._board[x_move] = shifted_row  # put the shifted row in place
+            self.put_row(x_move, shifted_row)  # put the shifted row in place
 
     def push_down(self, coordinates, direction):
         """
@@ -295,36 +620,26 @@ class KubaGame:
             #unchanged top: row range(x_move)
             #changed: row range(x_move,x_move+counter+1)
             #unchanged bottomn:row_range...rest
-            temp = []
+            temp = ["X"]
             for row in range(x_move, x_move+counter+1):
-                for column in range(0,7):
-                    if column == y_move:
-                        temp_marble = self.get_marble((row,column))
-                        temp.insert(0, temp_marble)
-            temp.append("X")
-            # insert back
+                temp.append(self.get_marble((row, y_move)))
+            # insert back, one row further down
             for row in range(x_move, x_move+counter+2):
-                to_insert = temp.pop()
-                self.place_marble(row, y_move, to_insert)
+                self.place_marble(row, y_move, temp[row - x_move])
 
         # no vacant square ahead of the move
         elif counter is None:
             # save the marble to be pushed off
-            self._pushed_off = self.get_marble((6,y_move))
+            self._pushed_off = self.get_marble((self._size - 1, y_move))
 
             # unchanged: row range(x_move)
-            # changed: row range(x_move, 7)
-            temp = []
-            for row in range(x_move, 6):
-                for column in range(0,7):
-                    if column == y_move:            #along the moving axis
-                        temp_marble = self.get_marble((row,column))
-                        temp.insert(0, temp_marble)
-            temp.append("X")
-            # insert back
-            for row in range(x_move,7):
-                to_insert = temp.pop()
-                self.place_marble(row,y_move,to_insert)
+            # changed: row range(x_move, size)
+            temp = ["X"]
+            for row in range(x_move, self._size - 1):
+                temp.append(self.get_marble((row, y_move)))
+            # insert back, one row further down
+            for row in range(x_move, self._size):
+                self.place_marble(row, y_move, temp[row - x_move])
 
     def push_up(self, coordinates, direction):
         """
@@ -338,62 +653,42 @@ class KubaGame:
 
         # vacant square ahead of the move
         if counter is not None:
-            # unchanged bottomn: row range(x_move+1, 7)
+            # unchanged bottomn: row range(x_move+1, size)
             # changed: row range: (x_move-counter, x_move)
             # unchanged: row range: rest at top
 
-            temp = []
+            temp = ["X"]
             for row in reversed(range(x_move-counter, x_move+1)):
-                for column in range(0,7):
-                    if column == y_move:
-                        temp_marble = self.get_marble((row,column))
-                        temp.insert(0, temp_marble)
-            temp.append("X")
-            # insert back
+                temp.append(self.get_marble((row, y_move)))
+            # insert back, one row further up
             for row in reversed(range(x_move-counter-1,x_move+1)):
-                to_insert = temp.pop()
-                self.place_marble(row,y_move,to_insert)
+                self.place_marble(row, y_move, temp[x_move - row])
 
         # no vacant square ahead of the move
         elif counter is None:
             # save the marble to be pushed off
             self._pushed_off = self.get_marble((0, y_move))
 
-            # unchanged: row range(x_move+1,7)
+            # unchanged: row range(x_move+1,size)
             # changed: row range(x_move+1)
-            temp = []
+            temp = ["X"]
             for row in reversed(range(1,x_move+1)):
-                for column in range(0,7):
-                    if column == y_move:
-                        temp_marble = self.get_marble((row, column))
-                        temp.insert(0, temp_marble)
-            temp.append("X")
-            # insert back
+                temp.append(self.get_marble((row, y_move)))
+            # insert back, one row further up
             for row in reversed(range(0,x_move+1)):
-                to_insert = temp.pop()
-                self.place_marble(row, y_move, to_insert)
+                self.place_marble(row, y_move, temp[x_move - row])
 
     def get_preceding_marble(self, coordinates, direction):
         """
         Takes coordinates and direction.
         Returns the marble that precedes the marble at the coordinates
         along the given direction.
+        Returns None if the marble is on the edge of the board behind it.
         """
-        x_move = self.get_x(coordinates)
-        y_move = self.get_y(coordinates)
-
-        if direction == "B":
-            x_preceding = x_move - 1
-            return self.get_marble((x_preceding, y_move))
-        elif direction == "F":
-            x_preceding = x_move + 1
-            return self.get_marble((x_preceding, y_move))
-        elif direction == "R":
-            y_preceding = y_move - 1
-            return self.get_marble((x_move, y_preceding))
-        elif direction == "L":
-            y_preceding = y_move + 1
-            return self.get_marble((x_move, y_preceding))
+        preceding = self._line_tables[(coordinates[0], coordinates[1], direction)][1]
+        if preceding is None:
+            return None
+        return self._board[preceding[0]][preceding[1]]
 
     def validate_move(self, playerName, coordinates, direction):
         """
@@ -417,18 +712,19 @@ class KubaGame:
             self._is_valid = False
             return self._is_valid
 
-        # Check if the coordinates are valid
-        # Empty string, less than 2 indices, or more than 2 indices
-        if len(str(coordinates)) != 6:
+        # Check if the coordinates are valid: a (row, column) pair of ints on the board has an entry in the
+        # line tables. Other numbers, such as 1.0 or True, hash like the ints but are not coordinates
+        try:
+            row, column = coordinates
+            line_entry = None
+            if type(row) is int and type(column) is int:
+                line_entry = self._line_tables.get((row, column, direction))
+        except (TypeError, ValueError):
+            line_entry = None
+        if line_entry is None:
             self._is_valid = False
             return self._is_valid
-        else:
-            if self.get_x(coordinates) not in range(0,7) or self.get_y(coordinates) not in range(0,7):
-                self._is_valid = False
-                return self._is_valid
-
-        x_move = self.get_x(coordinates)
-        y_move = self.get_y(coordinates)
+        ray, preceding, edge_ahead = line_entry
 
         # Check if the game has been won
         if self._state != "UNFINISHED":
@@ -447,49 +743,105 @@ class KubaGame:
             self._is_valid = False
             return self._is_valid
 
-        # Check edge of the board preceding or empty space preceding
-        # edge of the board
-        # if x_move in [0,6] or y_move in [0,6]:
-
-        if direction == 'F':
-            if x_move == 0:
-                self._is_valid = False
-                return self._is_valid
-            elif x_move == 6:
-                return self._is_valid
-            elif self.get_preceding_marble(coordinates, direction) != "X":
-                self._is_valid = False
+        # Cannot push towards the edge of the board the marble is standing on
+        if edge_ahead:
+            self._is_valid = False
             return self._is_valid
 
-        elif direction == 'B':
-            if x_move == 6:
-                self._is_valid = False
-                return self._is_valid
-            elif x_move == 0:
-                return self._is_valid
-            elif self.get_preceding_marble(coordinates, direction) != "X":
-                self._is_valid = False
-            return self._is_valid
+        # The preceding square must be the edge of the board or empty
+        if preceding is not None and self._board[preceding[0]][preceding[1]] != "X":
+            self._is_valid = False
+        return self._is_valid
 
-        elif direction == 'L':
-            if y_move == 0:
-                self._is_valid = False
-                return self._is_valid
-            elif y_move == 6:
-                return self._is_valid
-            elif self.get_preceding_marble(coordinates, direction) != "X":
-                self._is_valid = False
-            return self._is_valid
-        elif direction == 'R':
-            if y_move == 6:
-                self._is_valid = False
-                return self._is_valid
-            elif y_move == 0:
-                return self._is_valid
-            elif self.get_preceding_marble(coordinates, direction) != "X":
-                self._is_valid = False
-            return self._is_valid
 
+    def legal_moves(self, playerName):
+        """
+        Takes a player name.
+        Generates every (coordinates, direction) pair that make_move would accept from the player
+        in the current position: the marble is the player's, the preceding square is the edge or
+        empty, the push does not push off the player's own marble and it does not undo the
+        opponent's last move. Generates nothing if it is not the player's turn.
+        """
+        if self.get_winner() is not None or self._state != "UNFINISHED":
+            return
+        if self.get_current_turn() is not None and playerName != self.get_current_turn():
+            return
+        color = self.get_color(playerName)
+        if color not in self._marble_squares:
+            return
+
+        # hash of the board a move may not recreate
+        ko_hash = None
+        if len(self._pre_opponent_move) > 0:
+            ko_hash = self._pre_opponent_move[0]
+
+        board = self._board
+        for coordinates in tuple(self._marble_squares[color]):
+            for direction in self._valid_direction:
+                ray, preceding, edge_ahead = self._line_tables[(coordinates[0], coordinates[1], direction)]
+                # cannot push towards the edge the marble is standing on
+                if edge_ahead:
+                    continue
+                # the preceding square must be the edge of the board or empty
+                if preceding is not None and board[preceding[0]][preceding[1]] != "X":
+                    continue
+
+                counter = self.count_consecutive(coordinates, direction)
+                if counter is None:
+                    # the marble on the edge would be pushed off; a push off can never recreate
+                    # an earlier board because marbles never come back
+                    if board[ray[-1][0]][ray[-1][1]] == color:
+                        continue
+                elif ko_hash is not None and self.get_push_hash(coordinates, direction, counter) == ko_hash:
+                    continue
+                yield coordinates, direction
+
+    def get_push_hash(self, coordinates, direction, counter):
+        """
+        Takes the coordinates, direction and count_consecutive of a push that stops at a vacant square.
+        Returns the board hash the push would leave, without making it.
+        """
+        ray = self._line_tables[(coordinates[0], coordinates[1], direction)][0]
+        # the marbles from the coordinates up to the vacant square each move one step ahead
+        new_hash = self._board_hash
+        previous = "X"
+        for row, column in ((coordinates[0], coordinates[1]),) + ray[:counter + 1]:
+            keys = self._zobrist_squares[row][column]
+            marble = self._board[row][column]
+            new_hash ^= keys[marble] ^ keys[previous]
+            previous = marble
+        return new_hash
+
+    def add_observer(self, observer):
+        """
+        Takes a callable observer(event). The observer is sent a MoveEvent after every successful
+        make_move and unmake_move, and after every make_move call that validate_move rejects.
+        Calls rejected for pushing off the player's own marble or undoing the opponent's move
+        leave the game as it was and are not sent. Boards set with set_board or set_position
+        are not sent.
+        """
+        self._observers.append(observer)
+
+    def remove_observer(self, observer):
+        """
+        Takes an observer added with add_observer and stops sending it events.
+        """
+        self._observers.remove(observer)
+
+    def notify_observers(self, playerName, coordinates, direction, changes, pushed_off, undo, rejected=False):
+        """
+        Takes the move, its list of (square, marble before, marble after), the marble pushed off,
+        whether it was taken back and whether it was rejected. Sends the MoveEvent to every observer.
+        """
+        if undo:
+            cells = tuple((square[0], square[1], before) for square, before, after in changes)
+        else:
+            cells = tuple((square[0], square[1], after) for square, before, after in changes)
+        event = MoveEvent(playerName, coordinates, direction, cells, pushed_off,
+                          {self._nameA: self._nameA_red, self._nameB: self._nameB_red},
+                          self._current_turn, self.get_winner(), undo, rejected)
+        for observer in list(self._observers):
+            observer(event)
 
     def make_move(self, playerName, coordinates, direction):
         """
@@ -500,9 +852,9 @@ class KubaGame:
         Returns False if the move is invalid or unsuccessful.
         Updates marble count, turn, game state.
         """
-        # Copy the board of before opponent move for later comparison
-        pre_opp_move = copy.deepcopy(self._board)
-        self._pre_opponent_move.insert(0, pre_opp_move)
+        # Keep the hash of the board before opponent move for later comparison
+        self.own_history()
+        self._pre_opponent_move.insert(0, self._board_hash)
 
         # validate moves
         # call self.validate_move
@@ -511,12 +863,16 @@ class KubaGame:
         if self._is_valid is False:
             self._is_valid = None  # reset is_valid
             self._pushed_off = None # reset _pushed_off
+            # the board before the call is still kept for the ko rule
+            if self._observers:
+                self.notify_observers(playerName, coordinates, direction, [], None, False, True)
             #print("False")
             return False
 
         else:
-            marble_count_before = self.get_marble_count()
-            red_count_before = marble_count_before[2]
+            # a push only changes the row or column it happens on
+            line = self.get_line(coordinates, direction)
+            line_before = [self._board[square[0]][square[1]] for square in line]
 
             if direction == "R":  # right
                 self.push_right(coordinates,direction)
@@ -526,6 +882,8 @@ class KubaGame:
                 self.push_down(coordinates,direction)
             elif direction == "F":  # upward
                 self.push_up(coordinates, direction)
+            changes = self.get_line_changes(line, line_before)
+            new_hash = self._board_hash ^ self.get_changes_hash(changes)
 
             # verify if a player pushes off his own marble
             if self._pushed_off is not None:
@@ -533,7 +891,7 @@ class KubaGame:
                 if self._pushed_off == player_marble:
                 # if the marble to be pushed is the same as the playerName's marble,
                 # invalid move, undo this move, return False
-                    self._board = self._pre_opponent_move[0]  # go back to pre-this-move, i.e. post-last-move
+                    self.undo_changes(changes)              # go back to pre-this-move, i.e. post-last-move
                     self._pre_opponent_move.pop(0)  # pre-this-move board is no longer needed
                     #print("Invalid move, cannot push off your own marble.")
                     self._pushed_off = None  # reset _pushed_off
@@ -542,24 +900,40 @@ class KubaGame:
                 self._pushed_off = None  # reset _pushed_off
 
             #compare board
-            if len(self._pre_opponent_move) > 1 and self._board == self._pre_opponent_move[1]:
+            if len(self._pre_opponent_move) > 1 and new_hash == self._pre_opponent_move[1]:
                     #print("Invalid, undo move")
-                    self._board = self._pre_opponent_move[0]   # go back to pre-this-move, i.e. post-last-move
+                    self.undo_changes(changes)                 # go back to pre-this-move, i.e. post-last-move
                     self._pre_opponent_move.pop(0)             # pre-this-move board is no longer needed
                     return False
-            elif len(self._pre_opponent_move) > 1 and self._board != self._pre_opponent_move[1]:
+
+            history_length = len(self._pre_opponent_move) - 1
+            history_popped = None
+            if len(self._pre_opponent_move) > 1 and new_hash != self._pre_opponent_move[1]:
             # self._board != pre-last-move
-                self._pre_opponent_move.pop()           # this move is verified in terms of undo moves
+                history_popped = self._pre_opponent_move.pop()  # this move is verified in terms of undo moves
+
+            # a marble left the board
+            if self._pushed_off is not None:
+                self._marble_count[self._pushed_off] -= 1
 
             # if red captured
-            marble_count_after = self.get_marble_count()
-            red_count_after = marble_count_after[2]
-            if red_count_after != red_count_before:
+            red_captured_by = None
+            if self._pushed_off == "R":
+                red_captured_by = playerName
                 if playerName == self._nameA:
                     self._nameA_red += 1
                 elif playerName == self._nameB:
                     self._nameB_red += 1
 
+            # record what this move changed so that unmake_move can take it back
+            record = (changes, self._pushed_off, red_captured_by, self._current_turn,
+                      self._state, history_length, history_popped, (playerName, coordinates, direction))
+            self._move_records = (record, self._move_records)
+
+            self._board_hash = new_hash
+            self.update_marble_squares(changes)
+            self.update_occupancy(changes)
+
             # finishing up the game
             # mark turn
             next_turn = self.get_opponent(playerName)
@@ -572,9 +946,107 @@ class KubaGame:
             if self.get_winner() is not None:
                 #print(self.get_winner())
                 self.get_winner()
+
+            if self._observers:
+                self.notify_observers(playerName, coordinates, direction, changes, record[1], False)
             # print("True")
             return True
 
+    def unmake_move(self):
+        """
+        Takes back the last successful move using its delta record: puts back the changed squares
+        and the pushed off marble, and restores the red captures, turn, game state and the boards
+        kept for comparison. Returns True if a move was taken back, False if there is none.
+        """
+        if self._move_records is None:
+            return False
+        record, self._move_records = self._move_records
+        changes, pushed_off, red_captured_by, turn, state, history_length, history_popped, move = record
+        self.own_history()
+
+        self.undo_changes(changes)
+        self._board_hash ^= self.get_changes_hash(changes)
+        self.update_marble_squares([(square, after, before) for square, before, after in changes])
+        self.update_occupancy(changes)
+
+        if pushed_off is not None:
+            self._marble_count[pushed_off] += 1
+        if red_captured_by is not None:
+            if red_captured_by == self._nameA:
+                self._nameA_red -= 1
+            elif red_captured_by == self._nameB:
+                self._nameB_red -= 1
+
+        # drop the hashes inserted since the move, and put back the one it verified
+        if history_popped is not None:
+            history_length -= 1
+        del self._pre_opponent_move[:len(self._pre_opponent_move) - history_length]
+        if history_popped is not None:
+            self._pre_opponent_move.append(history_popped)
+
+        self._current_turn = turn
+        self._state = state
+        self._is_valid = None
+        self._pushed_off = None
+        if self._observers:
+            self.notify_observers(move[0], move[1], move[2], changes, pushed_off, True)
+        return True
+
+    def own_history(self):
+        """
+        Copies the list of board hashes kept for comparison if it is shared with a fork,
+        so that it can be written.
+        """
+        if self._history_shared:
+            self._pre_opponent_move = list(self._pre_opponent_move)
+            self._history_shared = False
+
+    def fork(self):
+        """
+        Returns an independent game in the same position, which can also take back the moves made
+        before the fork. The two games share the board rows, the hash history and the marble squares
+        until one of them writes to them, so forking costs about the same at any point in a game.
+        Observers are not carried over to the fork.
+        """
+        fork = KubaGame.__new__(KubaGame)
+        fork._nameA = self._nameA
+        fork._nameB = self._nameB
+        fork._colorA = self._colorA
+        fork._colorB = self._colorB
+        fork._state = self._state
+        fork._current_turn = self._current_turn
+        fork._nameA_red = self._nameA_red
+        fork._nameB_red = self._nameB_red
+        fork._is_valid = self._is_valid
+        fork._pushed_off = self._pushed_off
+        fork._valid_direction = self._valid_direction
+        fork._size = self._size
+        fork._red_to_win = self._red_to_win
+        fork._zobrist_squares = self._zobrist_squares
+        fork._zobrist_turn = self._zobrist_turn
+        fork._zobrist_captures = self._zobrist_captures
+        fork._line_tables = self._line_tables
+        fork._run_tables = self._run_tables
+        fork._debug = self._debug
+        fork._observers = []
+        fork._board_hash = self._board_hash
+        fork._marble_count = dict(self._marble_count)
+        fork._occupancy = list(self._occupancy)
+        # move records are never written once made, so the linked list is shared as is
+        fork._move_records = self._move_records
+
+        # shared until written: from now on both games copy a row, the history or the squares before writing
+        fork._board = list(self._board)
+        self._shared_rows = [True] * self._size
+        fork._shared_rows = [True] * self._size
+        fork._pre_opponent_move = self._pre_opponent_move
+        self._history_shared = True
+        fork._history_shared = True
+        fork._marble_squares = self._marble_squares
+        self._squares_shared = True
+        fork._squares_shared = True
+        return fork
+
     def get_winner(self):
         """
         Returns the name of the winning player.
@@ -583,11 +1055,11 @@ class KubaGame:
         If so, change game_state to "FINISHED". If not, no update.
         """
         marble_count = self.get_marble_count()
-        if self._nameA_red == 7:  # PlayerA captures 7 red, won
+        if self._nameA_red == self._red_to_win:  # PlayerA captures 7 red (on 7x7), won
             self._state = "FINISHED"
             #print(self._state)
             return self._nameA
-        elif self._nameB_red == 7:  # PlayerB captures 7 red, won
+        elif self._nameB_red == self._red_to_win:  # PlayerB captures 7 red (on 7x7), won
             self._state = "FINISHED"
             #print(self._state)
             return self._nameB
@@ -627,16 +1099,23 @@ class KubaGame:
         Returns the number of marbles currently on the board,
         in the following order: White, Black, and Red as tuple (W,B,R).
         """
+        marble_count = (self._marble_count["W"], self._marble_count["B"], self._marble_count["R"])
+        if self._debug and marble_count != self.count_marbles():
+            raise AssertionError("running marble count %s does not match the board %s"
+                                 % (marble_count, self.count_marbles()))
+        return marble_count
+
+    def count_marbles(self):
+        """
+        Counts the marbles on the board square by square.
+        Returns the counts in the following order: White, Black, and Red as tuple (W,B,R).
+        """
         count_W = 0
         count_B = 0
         count_R = 0
 
-        for row in range(0,7):
-            for column in range(0,7):
-                if self.get_marble((row,column)) == "W":
-                    count_W += 1
-                elif self.get_marble((row, column)) == "B":
-                    count_B += 1
-                elif self.get_marble((row, column)) == "R":
-                    count_R += 1
+        for row in self._board:
+            count_W += row.count("W")
+            count_B += row.count("B")
+            count_R += row.count("R")
         return (count_W, count_B, count_R)
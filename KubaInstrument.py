@@ -0,0 +1,215 @@
+# Description: Opt-in instrumentation for KubaGame. An Instrumentation attached to a game wraps its hot-path
+# methods on that instance only, recording call counts, cumulative and percentile timings per method, the
+# reason for every rejected make_move and, optionally, the bytes allocated per move. Games that are not
+# attached run the plain class methods, so instrumentation costs nothing when it is not used.
+import random
+import time
+import tracemalloc
+
+# methods wrapped on an attached game
+INSTRUMENTED_METHODS = ("make_move", "unmake_move", "validate_move", "push_right", "push_left", "push_down",
+                        "push_up", "count_consecutive", "get_marble_count", "get_winner")
+
+# reasons make_move rejects a move, in the order they are checked
+REJECTION_REASONS = ("finished", "invalid_input", "wrong_turn", "wrong_color", "edge_ahead",
+                     "blocked_preceding", "own_push_off", "ko")
+
+
+def rejection_reason(game, playerName, coordinates, direction):
+    """
+    Takes a game and the arguments of a make_move call that returned False, with the game as it
+    is after the call (a rejected move leaves the board unchanged).
+    Returns the reason the move was rejected, one of REJECTION_REASONS. Calls the class methods,
+    so the instrumented methods of an attached game are not counted.
+    """
+    cls = type(game)
+    if cls.get_winner(game) is not None:
+        return "finished"
+    size = game.get_size()
+    if direction not in ("B", "F", "L", "R") or not playerName:
+        return "invalid_input"
+    try:
+        row, column = coordinates
+    except (TypeError, ValueError):
+        return "invalid_input"
+    if type(row) is not int or type(column) is not int or not (0 <= row < size and 0 <= column < size):
+        return "invalid_input"
+    if game.get_current_turn() is not None and playerName != game.get_current_turn():
+        return "wrong_turn"
+    if game.get_color(playerName) != game.get_marble(coordinates):
+        return "wrong_color"
+    row_step, column_step = {"B": (1, 0), "F": (-1, 0), "L": (0, -1), "R": (0, 1)}[direction]
+    if not (0 <= row + row_step < size and 0 <= column + column_step < size):
+        return "edge_ahead"
+    if 0 <= row - row_step < size and 0 <= column - column_step < size:
+        if game.get_marble((row - row_step, column - column_step)) != "X":
+            return "blocked_preceding"
+    if cls.get_push_off_marble(game, coordinates, direction) == game.get_color(playerName):
+        return "own_push_off"
+    return "ko"
+
+
+class Distribution:
+    """
+    The class representing a stream of measurements (call times, bytes): count, total, maximum and
+    a bounded random sample of the values for percentiles.
+    """
+    def __init__(self, sample_size, rng):
+        """
+        Takes the most values to keep and the random.Random used for reservoir sampling.
+        """
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self._samples = []
+        self._sample_size = sample_size
+        self._rng = rng
+
+    def add(self, value):
+        """
+        Takes one measurement and records it.
+        """
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if len(self._samples) < self._sample_size:
+            self._samples.append(value)
+        else:
+            index = self._rng.randrange(self.count)
+            if index < self._sample_size:
+                self._samples[index] = value
+
+    def percentile(self, fraction):
+        """
+        Takes a fraction between 0 and 1. Returns that percentile of the sampled values.
+        """
+        if len(self._samples) == 0:
+            return 0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def snapshot(self):
+        """
+        Returns the count, total, mean, 50th, 90th and 99th percentiles and maximum as a dict.
+        """
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0,
+            "p50": self.percentile(0.50),
+            "p90": self.percentile(0.90),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class Instrumentation:
+    """
+    The class representing the instrumentation of one or more games. Stats of all attached games are added up.
+    """
+    def __init__(self, sample_size=10000, track_allocations=False):
+        """
+        Takes the most call times to keep per method for percentiles, and whether to measure the
+        bytes allocated by each make_move with tracemalloc (which slows every allocation down).
+        """
+        self._sample_size = sample_size
+        self._track_allocations = track_allocations
+        self._rng = random.Random(0)
+        self._games = []
+        self._started_tracing = False   # whether attach started tracemalloc, so detach stops it
+        self._paused = False            # while True, calls are not recorded
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the recorded stats.
+        """
+        self._methods = {name: Distribution(self._sample_size, self._rng) for name in INSTRUMENTED_METHODS}
+        self._rejections = dict.fromkeys(REJECTION_REASONS, 0)
+        self._move_bytes = Distribution(self._sample_size, self._rng)
+
+    def attach(self, game):
+        """
+        Takes a KubaGame and starts instrumenting it.
+        """
+        for name in INSTRUMENTED_METHODS:
+            setattr(game, name, self.wrap(game, name, getattr(game, name)))
+        if self._track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._games.append(game)
+
+    def detach(self, game):
+        """
+        Takes an attached KubaGame and stops instrumenting it.
+        Stops tracemalloc once the last game is detached, if attach started it.
+        """
+        for name in INSTRUMENTED_METHODS:
+            del game.__dict__[name]
+        self._games.remove(game)
+        if self._started_tracing and len(self._games) == 0:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def wrap(self, game, name, method):
+        """
+        Takes a game, the name of a method and the bound method.
+        Returns a function that calls the method and records its time.
+        """
+        clock = time.perf_counter
+
+        if name != "make_move":
+            def timed(*args):
+                if self._paused:
+                    return method(*args)
+                start = clock()
+                try:
+                    return method(*args)
+                finally:
+                    self._methods[name].add(clock() - start)
+            return timed
+
+        def timed_move(playerName, coordinates, direction):
+            if self._track_allocations:
+                start_bytes = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            start = clock()
+            try:
+                result = method(playerName, coordinates, direction)
+            finally:
+                self._methods[name].add(clock() - start)
+            if self._track_allocations:
+                self._move_bytes.add(tracemalloc.get_traced_memory()[1] - start_bytes)
+            if result is False:
+                # the reason is found with calls into the game, which are not the game's own calls
+                self._paused = True
+                try:
+                    reason = rejection_reason(game, playerName, coordinates, direction)
+                finally:
+                    self._paused = False
+                self._rejections[reason] += 1
+            return result
+        return timed_move
+
+    def snapshot(self):
+        """
+        Returns the recorded stats as a dict: the calls and call times in seconds of each method,
+        rejected moves by reason and, if tracked, the bytes allocated per make_move.
+        """
+        snapshot = {
+            "methods": {name: stats.snapshot() for name, stats in self._methods.items()},
+            "rejections": dict(self._rejections),
+        }
+        if self._track_allocations:
+            snapshot["move_bytes"] = self._move_bytes.snapshot()
+        return snapshot
+
+
+def instrument(game, sample_size=10000, track_allocations=False):
+    """
+    Takes a KubaGame and the Instrumentation options. Returns a new Instrumentation attached to the game.
+    """
+    instrumentation = Instrumentation(sample_size, track_allocations)
+    instrumentation.attach(game)
+    return instrumentation
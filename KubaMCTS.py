@@ -0,0 +1,430 @@
+# Description: Monte Carlo tree search player for KubaGame. MCTSPlayer grows a UCT search tree within a time
+# budget per move: each simulation selects moves down the tree by UCT, expands a leaf with its legal moves,
+# plays a short random playout with make_move, scores it (win, loss, or the material balance where the
+# playout stops) and backs the score up the path. The moves are taken back with unmake_move.
+#
+# The tree is kept in flat arrays (MCTSTree), one entry per node, with the children of a node stored next
+# to each other. After a move and the opponent's reply, the subtree under the position reached is compacted
+# to the front of the arrays and searched on, instead of starting over. With several workers, the player
+# searches independent trees from the root in threads or processes and adds up their root visit counts.
+import math
+import random
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from KubaRecord import decode_move, encode_move
+from KubaSearch import evaluate_material
+
+NO_NODE = -1
+NO_KEY = 0                      # key of a node whose position has not been reached yet
+SCORE_SCALE = 200.0             # material score at which a cut off playout counts as 73% won
+
+
+def get_node_key(game):
+    """
+    Takes a game. Returns the key of its position, which includes the board hash that the next
+    move may not recreate, as a signed 64-bit number.
+    """
+    history = game.get_pre_oppo_move()
+    key = hash((game.position_hash(), history[0] if len(history) > 0 else None))
+    return key if key != NO_KEY else 1
+
+
+class MCTSTree:
+    """
+    The class representing a search tree stored in flat arrays: node i is entry i of every array,
+    and the children of a node are the nodes from its first child on, one per legal move.
+    Node 0 is the root.
+    """
+    def __init__(self):
+        """
+        Creates an empty tree.
+        """
+        self.clear()
+
+    def clear(self, size=7):
+        """
+        Takes the board size of the positions the tree will hold. Removes every node.
+        """
+        self._size = size
+        self._parent = array("i")
+        self._move = array("H")             # encoded move from the parent to the node
+        self._player = array("b")           # index of the player to move at the node
+        self._first_child = array("i")      # NO_NODE until the node is expanded
+        self._child_count = array("H")
+        self._visits = array("I")
+        self._reward = array("d")           # total score of the player who moved to the node
+        self._key = array("q")              # get_node_key of the node's position
+
+    def __len__(self):
+        """
+        Returns the number of nodes.
+        """
+        return len(self._parent)
+
+    def add_node(self, parent, move, player, key=NO_KEY, visits=0, reward=0.0):
+        """
+        Takes the parent node (NO_NODE for the root), the encoded move to the node, the index of the
+        player to move, the position key and the visit and reward totals. Returns the new node.
+        """
+        self._parent.append(parent)
+        self._move.append(move)
+        self._player.append(player)
+        self._first_child.append(NO_NODE)
+        self._child_count.append(0)
+        self._visits.append(visits)
+        self._reward.append(reward)
+        self._key.append(key)
+        return len(self._parent) - 1
+
+    def get_move(self, node):
+        """
+        Takes a node. Returns the (coordinates, direction) of the move to it.
+        """
+        return decode_move(self._move[node], self._size)
+
+    def get_player(self, node):
+        """
+        Takes a node. Returns the index of the player to move at it.
+        """
+        return self._player[node]
+
+    def get_visits(self, node):
+        """
+        Takes a node. Returns the number of simulations through it.
+        """
+        return self._visits[node]
+
+    def get_key(self, node):
+        """
+        Takes a node. Returns its position key, or NO_KEY if it has not been reached.
+        """
+        return self._key[node]
+
+    def set_key(self, node, key):
+        """
+        Takes a node and the key of its position. Stores the key.
+        """
+        self._key[node] = key
+
+    def is_expanded(self, node):
+        """
+        Takes a node. Returns True if its children have been added.
+        """
+        return self._first_child[node] != NO_NODE
+
+    def get_children(self, node):
+        """
+        Takes a node. Returns the range of its children.
+        """
+        first = self._first_child[node]
+        if first == NO_NODE:
+            return range(0)
+        return range(first, first + self._child_count[node])
+
+    def expand(self, node, moves):
+        """
+        Takes a node and the encoded legal moves of the player to move at it. Adds one child per move.
+        """
+        self._first_child[node] = len(self._parent)
+        self._child_count[node] = len(moves)
+        opponent = 1 - self._player[node]
+        for move in moves:
+            self.add_node(node, move, opponent)
+
+    def select_child(self, node, exploration):
+        """
+        Takes an expanded node with children and the UCT exploration constant.
+        Returns its first unvisited child, or else the child with the highest UCT score.
+        """
+        visits = self._visits
+        reward = self._reward
+        log_visits = math.log(max(visits[node], 1))
+        best_child = NO_NODE
+        best_score = -1.0
+        for child in self.get_children(node):
+            count = visits[child]
+            if count == 0:
+                return child
+            score = reward[child] / count + exploration * math.sqrt(log_visits / count)
+            if score > best_score:
+                best_score = score
+                best_child = child
+        return best_child
+
+    def backup(self, node, score):
+        """
+        Takes the node a simulation ended at and its score for player index 0, from 0 to 1.
+        Adds the visit and score to the node and every node above it.
+        """
+        while node != NO_NODE:
+            self._visits[node] += 1
+            # the reward of a node is scored for the player who moved to it
+            self._reward[node] += score if self._player[node] == 1 else 1.0 - score
+            node = self._parent[node]
+
+    def find_node(self, key, player, depth=2):
+        """
+        Takes a position key, the index of the player to move and how many moves below the root
+        to look. Returns the shallowest node with that position, or NO_NODE.
+        """
+        level = [0] if len(self._parent) > 0 else []
+        for distance in range(depth + 1):
+            for node in level:
+                if self._key[node] == key and self._player[node] == player:
+                    return node
+            level = [child for node in level for child in self.get_children(node)]
+        return NO_NODE
+
+    def reroot(self, node):
+        """
+        Takes a node. Makes it the root, keeping only its subtree, which is compacted to the front
+        of the arrays in breadth-first order so that children stay next to each other.
+        """
+        move, player, key = self._move, self._player, self._key
+        first_child, child_count = self._first_child, self._child_count
+        visits, reward = self._visits, self._reward
+        self.clear(self._size)
+        self.add_node(NO_NODE, move[node], player[node], key[node], visits[node], reward[node])
+        order = [node]
+        index = 0
+        # the node at position index of order is new node index
+        while index < len(order):
+            old_node = order[index]
+            first = first_child[old_node]
+            if first != NO_NODE:
+                self._first_child[index] = len(self._parent)
+                self._child_count[index] = child_count[old_node]
+                for child in range(first, first + child_count[old_node]):
+                    self.add_node(index, move[child], player[child], key[child], visits[child], reward[child])
+                    order.append(child)
+            index += 1
+
+    def get_root_visits(self):
+        """
+        Returns a dict of the visits of each root move, by (coordinates, direction).
+        """
+        if len(self._parent) == 0:
+            return {}
+        return {self.get_move(child): self._visits[child] for child in self.get_children(0)}
+
+
+def search_process(game, playerName, settings, seed):
+    """
+    Takes a game, the player to move, the keyword arguments of an MCTSPlayer and a seed.
+    Searches the position with a new single-worker player. Returns the visits of each root move
+    and the number of simulations. Runs in a worker process.
+    """
+    player = MCTSPlayer(seed=seed, **settings)
+    player.choose_move(game, playerName)
+    return player.get_root_visits(), player.get_search_info()["simulations"]
+
+
+class MCTSPlayer:
+    """
+    The class representing a Monte Carlo tree search player that picks moves for KubaGame.
+    """
+    def __init__(self, time_limit=1.0, exploration=1.4, playout_depth=20, max_nodes=500000,
+                 max_simulations=None, workers=1, parallel="thread", seed=None):
+        """
+        Takes the time budget per move in seconds, the UCT exploration constant, the most random
+        moves per playout, the most nodes per tree, an optional cap on simulations per move, the
+        number of root-parallel workers, "thread" or "process" for how they run, and a seed.
+        """
+        self._time_limit = time_limit
+        self._exploration = exploration
+        self._playout_depth = playout_depth
+        self._max_nodes = max_nodes
+        self._max_simulations = max_simulations
+        self._workers = workers
+        self._parallel = parallel
+        self._rng = random.Random(seed)
+        self._trees = [MCTSTree() for index in range(workers if parallel == "thread" else 1)]
+        self._executor = None
+        self._root_visits = {}
+        self._info = {}
+
+    def get_search_info(self):
+        """
+        Returns a dict about the last search: simulations run, nodes in the trees, nodes reused
+        from the previous search and seconds taken.
+        """
+        return self._info
+
+    def get_root_visits(self):
+        """
+        Returns a dict of the visits of each root move in the last search, added up over the workers.
+        """
+        return self._root_visits
+
+    def close(self):
+        """
+        Shuts down the worker processes, if any.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        """
+        Returns the player, to be closed when the with block ends.
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """
+        Closes the player.
+        """
+        self.close()
+
+    def choose_move(self, game, playerName):
+        """
+        Takes a game and the name of the player to move.
+        Searches until the time budget runs out and returns the most visited (coordinates, direction),
+        or None if the player has no legal move. The game is left as it was.
+        """
+        start = time.perf_counter()
+        deadline = start + self._time_limit
+        if self._workers <= 1:
+            simulations, reused = self.search(self._trees[0], game, playerName, deadline, self._rng)
+            self._root_visits = self._trees[0].get_root_visits()
+            nodes = len(self._trees[0])
+        elif self._parallel == "thread":
+            seeds = [self._rng.getrandbits(64) for tree in self._trees]
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                results = list(executor.map(
+                    lambda index: self.search(self._trees[index], game.fork(), playerName, deadline,
+                                              random.Random(seeds[index])),
+                    range(self._workers)))
+            simulations = sum(result[0] for result in results)
+            reused = sum(result[1] for result in results)
+            self._root_visits = self.combine([tree.get_root_visits() for tree in self._trees])
+            nodes = sum(len(tree) for tree in self._trees)
+        else:
+            # worker processes search fresh trees, since they do not keep them between moves
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+            settings = {"time_limit": max(deadline - time.perf_counter(), 0.0), "exploration": self._exploration,
+                        "playout_depth": self._playout_depth, "max_nodes": self._max_nodes,
+                        "max_simulations": self._max_simulations}
+            # a fork drops the game's observers, which may not be picklable
+            fork = game.fork()
+            futures = [self._executor.submit(search_process, fork, playerName, settings,
+                                             self._rng.getrandbits(64)) for index in range(self._workers)]
+            results = [future.result() for future in futures]
+            simulations = sum(result[1] for result in results)
+            reused = 0
+            self._root_visits = self.combine([result[0] for result in results])
+            nodes = None
+
+        self._info = {"simulations": simulations, "nodes": nodes, "reused": reused,
+                      "seconds": time.perf_counter() - start}
+        if len(self._root_visits) == 0:
+            return None
+        # most visits first, then the smallest move, so that ties do not depend on the workers
+        return min(self._root_visits, key=lambda move: (-self._root_visits[move], move))
+
+    def combine(self, visit_dicts):
+        """
+        Takes dicts of the visits of each root move. Returns their sum per move.
+        """
+        visits = {}
+        for visit_dict in visit_dicts:
+            for move, count in visit_dict.items():
+                visits[move] = visits.get(move, 0) + count
+        return visits
+
+    def search(self, tree, game, playerName, deadline, rng):
+        """
+        Takes a tree, a game, the player to move, the time to stop at and a random.Random.
+        Moves the tree to the game's position, reusing the matching subtree of the last search,
+        and runs simulations until the deadline. Returns the number of simulations and the number
+        of nodes reused. The game is left as it was.
+        """
+        names = (game.get_A()[0], game.get_B()[0])
+        player = names.index(playerName)
+        key = get_node_key(game)
+        node = tree.find_node(key, player)
+        if node == NO_NODE:
+            tree.clear(game.get_size())
+            tree.add_node(NO_NODE, 0, player, key)
+        elif node != 0:
+            tree.reroot(node)
+        reused = len(tree) - 1 if node != NO_NODE else 0
+        if game.get_winner() is not None:
+            return 0, reused
+
+        simulations = 0
+        while self._max_simulations is None or simulations < self._max_simulations:
+            if simulations & 15 == 0 and time.perf_counter() > deadline and simulations > 0:
+                break
+            self.simulate(tree, game, names, rng)
+            simulations += 1
+            if tree.is_expanded(0) and len(tree.get_children(0)) <= 1:
+                break
+        return simulations, reused
+
+    def simulate(self, tree, game, names, rng):
+        """
+        Takes a tree whose root is the game's position, the two player names and a random.Random.
+        Runs one simulation: selection, expansion, playout and backup.
+        """
+        node = 0
+        made = 0
+        # selection: follow UCT down to a node that has not been expanded
+        while tree.is_expanded(node) and len(tree.get_children(node)) > 0:
+            child = tree.select_child(node, self._exploration)
+            coordinates, direction = tree.get_move(child)
+            game.make_move(names[tree.get_player(node)], coordinates, direction)
+            made += 1
+            node = child
+            if tree.get_key(node) == NO_KEY:
+                tree.set_key(node, get_node_key(game))
+
+        # expansion: add the children of the leaf and step to the first one
+        if game.get_winner() is None and not tree.is_expanded(node) and len(tree) < self._max_nodes:
+            playerName = names[tree.get_player(node)]
+            size = game.get_size()
+            tree.expand(node, [encode_move(coordinates, direction, size)
+                               for coordinates, direction in sorted(game.legal_moves(playerName))])
+            if len(tree.get_children(node)) > 0:
+                child = tree.select_child(node, self._exploration)
+                coordinates, direction = tree.get_move(child)
+                game.make_move(playerName, coordinates, direction)
+                made += 1
+                node = child
+                tree.set_key(node, get_node_key(game))
+
+        score = self.playout(game, names, names[tree.get_player(node)], rng)
+        while made > 0:
+            game.unmake_move()
+            made -= 1
+        tree.backup(node, score)
+
+    def playout(self, game, names, playerName, rng):
+        """
+        Takes a game, the two player names, the player to move and a random.Random.
+        Plays up to playout_depth random legal moves, takes them back, and returns the score of
+        the position reached for the first player, from 0 to 1.
+        """
+        made = 0
+        winner = game.get_winner()
+        while winner is None and made < self._playout_depth:
+            moves = sorted(game.legal_moves(playerName))
+            if len(moves) == 0:
+                break
+            coordinates, direction = rng.choice(moves)
+            game.make_move(playerName, coordinates, direction)
+            made += 1
+            playerName = game.get_opponent(playerName)
+            winner = game.get_winner()
+
+        if winner is not None:
+            score = 1.0 if winner == names[0] else 0.0
+        else:
+            score = 1.0 / (1.0 + math.exp(-evaluate_material(game, names[0]) / SCORE_SCALE))
+        while made > 0:
+            game.unmake_move()
+            made -= 1
+        return score
@@ -0,0 +1,170 @@
+# Description: Perft move-tree enumeration for KubaGame. perft counts the leaf positions reachable through
+# legal moves to a given depth by making and taking back every move in place, divide breaks the count down
+# by root move, and parallel_perft splits the root moves across a process pool and reports nodes/sec.
+# With dedup, subtree counts are memoized by position hash (with the board ko forbids), so transpositions
+# are only walked once. Counts are the same either way; they stress legal_moves, the push routines and
+# unmake_move and measure raw engine speed.
+#
+# Usage: python KubaPerft.py DEPTH [--divide] [--dedup] [--workers N]
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from KubaGame import KubaGame
+from KubaSelfPlay import PLAYERS
+
+
+def get_moves(game):
+    """
+    Takes a game. Returns the sorted (playerName, coordinates, direction) legal moves of the player
+    to move, or of both players before the first move.
+    """
+    turn = game.get_current_turn()
+    if turn is not None:
+        players = [turn]
+    else:
+        players = [game.get_A()[0], game.get_B()[0]]
+    return [(playerName, coordinates, direction) for playerName in players
+            for coordinates, direction in sorted(game.legal_moves(playerName))]
+
+
+def get_key(game, depth):
+    """
+    Takes a game and a depth. Returns the memo key of the subtree: the position hash, the board
+    the next move may not recreate and the depth.
+    """
+    history = game.get_pre_oppo_move()
+    return game.position_hash(), history[0] if len(history) > 0 else None, depth
+
+
+def make(game, move):
+    """
+    Takes a game and a move from get_moves. Makes the move.
+    Raises RuntimeError if make_move rejects it, which means legal_moves and make_move disagree.
+    """
+    if not game.make_move(*move):
+        raise RuntimeError("make_move rejected the generated move %s" % (move,))
+
+
+def count_leaves(game, depth, table, bulk):
+    """
+    Takes a game, a depth of at least 1, the memo dict (None for no dedup) and whether to count
+    the moves at depth 1 without making them. Returns the number of leaves.
+    """
+    if table is not None:
+        key = get_key(game, depth)
+        if key in table:
+            return table[key]
+    moves = get_moves(game)
+    if depth == 1 and bulk:
+        count = len(moves)
+    else:
+        count = 0
+        for move in moves:
+            make(game, move)
+            count += 1 if depth == 1 else count_leaves(game, depth - 1, table, bulk)
+            game.unmake_move()
+    if table is not None:
+        table[key] = count
+    return count
+
+
+def perft(game, depth, dedup=False, bulk=True):
+    """
+    Takes a game, a depth, whether to memoize subtree counts by hash and whether to count the last
+    moves without making them. Returns the number of leaf positions at the depth.
+    The game is left as it was.
+    """
+    if depth == 0:
+        return 1
+    return count_leaves(game, depth, {} if dedup else None, bulk)
+
+
+def divide(game, depth, dedup=False, bulk=True):
+    """
+    Takes the arguments of perft. Returns a dict of the leaf count below each root move.
+    """
+    table = {} if dedup else None
+    counts = {}
+    if depth == 0:
+        return counts
+    for move in get_moves(game):
+        make(game, move)
+        if depth <= 1:
+            counts[move] = 1
+        else:
+            counts[move] = count_leaves(game, depth - 1, table, bulk)
+        game.unmake_move()
+    return counts
+
+
+def divide_move(game, move, depth, dedup, bulk):
+    """
+    Takes a game, a root move, a depth of at least 1 and the perft options.
+    Returns the root move and the leaf count below it. Runs in a worker process.
+    """
+    make(game, move)
+    if depth <= 1:
+        return move, 1
+    return move, count_leaves(game, depth - 1, {} if dedup else None, bulk)
+
+
+def parallel_perft(game, depth, workers=None, dedup=False, bulk=True):
+    """
+    Takes the arguments of perft and the number of worker processes (default: the number of CPUs).
+    Counts the subtrees of the root moves in parallel. Returns a dict with the leaf nodes, the
+    count below each root move, the seconds taken and the nodes per second.
+    """
+    start = time.perf_counter()
+    moves = get_moves(game)
+    workers = workers or os.cpu_count() or 1
+    counts = {}
+    if depth > 0 and len(moves) > 0:
+        # a fork drops the game's observers, which may not be picklable
+        fork = game.fork()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(divide_move, fork, move, depth, dedup, bulk) for move in moves]
+            for future in futures:
+                move, count = future.result()
+                counts[move] = count
+    nodes = sum(counts.values()) if depth > 0 else 1
+    seconds = time.perf_counter() - start
+    return {"nodes": nodes, "divide": counts, "seconds": seconds,
+            "nodes_per_sec": nodes / seconds if seconds else 0.0}
+
+
+def main(argv=None):
+    """
+    Takes the command line arguments. Runs perft from the starting position and prints the counts.
+    """
+    parser = argparse.ArgumentParser(description="Count KubaGame move trees from the starting position.")
+    parser.add_argument("depth", type=int)
+    parser.add_argument("--divide", action="store_true", help="print the count below each root move")
+    parser.add_argument("--dedup", action="store_true", help="memoize subtree counts by position hash")
+    parser.add_argument("--no-bulk", action="store_true", help="make the moves at the last depth too")
+    parser.add_argument("--workers", type=int, default=1, help="processes to split the root moves across")
+    args = parser.parse_args(argv)
+
+    game = KubaGame(*PLAYERS)
+    bulk = not args.no_bulk
+    if args.workers > 1:
+        result = parallel_perft(game, args.depth, args.workers, args.dedup, bulk)
+    else:
+        start = time.perf_counter()
+        counts = divide(game, args.depth, args.dedup, bulk)
+        seconds = time.perf_counter() - start
+        nodes = sum(counts.values()) if args.depth > 0 else 1
+        result = {"nodes": nodes, "divide": counts, "seconds": seconds,
+                  "nodes_per_sec": nodes / seconds if seconds else 0.0}
+    if args.divide:
+        for (playerName, coordinates, direction), count in result["divide"].items():
+            print("%s %s %s: %d" % (playerName, coordinates, direction, count))
+    print("depth %d: %d nodes in %.3fs (%.0f nodes/sec)"
+          % (args.depth, result["nodes"], result["seconds"], result["nodes_per_sec"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,352 @@
+# Description: Compact binary game records for KubaGame. A move (one of the squares and one of 4 directions)
+# is stored in one byte on boards up to 7x7, and in as few bytes as fit the move numbers on larger boards.
+# GameRecordWriter records games as they are played, as an observer of their moves, and appends each one to
+# an archive when it is finished; read_games streams the games of an archive back from a memory map.
+#
+# make_move calls that validate_move rejects are recorded too, as REJECTED: the game still keeps the board
+# before them for the ko rule, so a replay without them can reject a move the game accepted.
+#
+# Archive layout: the 5-byte file header b"KUBA" + version, then one record per game:
+#   name length, name and color (one ASCII byte) of player A, then the same for player B,
+#   board size (one byte),
+#   one number per move: (row * size + column) * 4 + direction index in DIRECTIONS, or REJECTED,
+#   END_OF_MOVES,
+#   index of the player who moved first, index of the winner (NO_PLAYER if none),
+#   red marbles captured by player A, red marbles captured by player B.
+# Move numbers, END_OF_MOVES, REJECTED and the captures are get_move_width(size) bytes each, big-endian;
+# END_OF_MOVES and REJECTED are the two largest numbers of that width. Version 1 archives have no board
+# size (always 7), no REJECTED and one byte per number.
+#
+# The offset index of an archive, ARCHIVE + INDEX_SUFFIX, holds the offset of every record in the archive
+# as an 8-byte little-endian number, so that the archive can be cut into shards without reading it.
+# GameRecordWriter keeps it up to date when it is given the index file, and write_index builds it for an
+# existing archive.
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+from KubaGame import KubaGame
+
+MAGIC = b"KUBA"
+VERSION = 2
+DIRECTIONS = "BFLR"
+END_OF_MOVES = 0xFF             # on boards up to 7x7; see get_end_of_moves
+REJECTED = 0xFE                 # on boards up to 7x7; see get_rejected
+NO_PLAYER = 0xFF
+INDEX_SUFFIX = ".idx"
+
+GameRecord = namedtuple("GameRecord", ["players", "first", "moves", "winner", "captured", "offset", "size",
+                                       "version"])
+GameRecord.__doc__ = """
+A game read from an archive: the two (player name, color) tuples, the index of the player who moved
+first, the encoded moves (a sequence of move numbers and get_rejected(size) for rejected calls), the
+index of the winner (None if none), the red marbles captured by each player, the offset of the record
+in the archive, the board size and the archive version (version 1 records have no rejected calls).
+"""
+
+
+def get_move_width(size):
+    """
+    Takes the board size. Returns the number of bytes a move number takes in a record.
+    """
+    width = 1
+    while 4 * size * size + 2 > 256 ** width:
+        width += 1
+    return width
+
+
+def get_end_of_moves(size):
+    """
+    Takes the board size. Returns the number that ends the moves of a record.
+    """
+    return 256 ** get_move_width(size) - 1
+
+
+def get_rejected(size):
+    """
+    Takes the board size. Returns the number that stands for a rejected make_move call.
+    """
+    return 256 ** get_move_width(size) - 2
+
+
+def encode_move(coordinates, direction, size=7):
+    """
+    Takes coordinates, direction and the board size. Returns the move as a number from 0 to
+    4 * size * size - 1 (195 on the 7x7 board).
+    """
+    return (coordinates[0] * size + coordinates[1]) * 4 + DIRECTIONS.index(direction)
+
+
+def decode_move(code, size=7):
+    """
+    Takes a move number from encode_move and the board size. Returns the (coordinates, direction) pair.
+    """
+    square, direction = divmod(code, 4)
+    return divmod(square, size), DIRECTIONS[direction]
+
+
+def _encode_numbers(numbers, width):
+    """
+    Takes a list of numbers and the bytes per number. Returns them as big-endian bytes.
+    """
+    if width == 1:
+        return bytes(numbers)
+    return b"".join(number.to_bytes(width, "big") for number in numbers)
+
+
+def _encode_record_end(moves, first, winner_index, captured, size):
+    """
+    Takes the move numbers, the index of the first mover and of the winner, the red captures of
+    both players and the board size. Returns the end of a record, from the moves on.
+    """
+    width = get_move_width(size)
+    return (_encode_numbers(list(moves) + [get_end_of_moves(size)], width) + bytes([first, winner_index])
+            + _encode_numbers(list(captured), width))
+
+
+class GameRecordWriter:
+    """
+    The class representing an archive that games are appended to while they are played.
+    """
+    def __init__(self, file, index=None):
+        """
+        Takes a binary file object opened for writing or appending, and optionally one for the offset
+        index of the archive. Writes the file header if the file is empty.
+        """
+        self._file = file
+        self._index = index
+        self._games = {}                # id of an attached game -> (observer, list of moves, header)
+        if file.tell() == 0:
+            file.write(MAGIC + bytes([VERSION]))
+
+    def attach(self, game):
+        """
+        Takes a KubaGame that has no moves yet. Records every move made on it and every make_move
+        call that validate_move rejects, and drops what unmake_move takes back, until finish is called.
+        """
+        size = game.get_size()
+        rejected = get_rejected(size)
+        header = bytearray()
+        for name, color in (game.get_A(), game.get_B()):
+            encoded = str(name).encode("utf-8")
+            header.append(len(encoded))
+            header += encoded
+            header += color.encode("ascii")
+        header.append(size)
+        moves = []
+
+        def observer(event):
+            if event.rejected:
+                moves.append((None, rejected))
+            elif event.undo:
+                # taking a move back also drops the calls rejected after it from the ko history
+                while moves[-1][0] is None:
+                    moves.pop()
+                moves.pop()
+            else:
+                moves.append((event.player, encode_move(event.coordinates, event.direction, size)))
+
+        self._games[id(game)] = (observer, moves, header)
+        game.add_observer(observer)
+
+    def finish(self, game):
+        """
+        Takes an attached game. Stops recording it and appends its record with the result to the archive.
+        """
+        observer, moves, header = self._games.pop(id(game))
+        game.remove_observer(observer)
+        size = game.get_size()
+        name_a = game.get_A()[0]
+        name_b = game.get_B()[0]
+        winner = game.get_winner()
+        if winner is None:
+            winner_index = NO_PLAYER
+        elif winner == name_a:
+            winner_index = 0
+        else:
+            winner_index = 1
+        first = 0
+        for player, code in moves:
+            if player is not None:
+                first = 0 if player == name_a else 1
+                break
+        captured = (game.get_captured(name_a), game.get_captured(name_b))
+        self.write_offset()
+        self._file.write(bytes(header) + _encode_record_end([code for player, code in moves], first, winner_index,
+                                                            captured, size))
+
+    def write_offset(self):
+        """
+        Writes the offset of the next record to the offset index, if the writer keeps one.
+        """
+        if self._index is not None:
+            self._index.write(struct.pack("<Q", self._file.tell()))
+
+    def write_record(self, record):
+        """
+        Takes a GameRecord and appends it to the archive as is.
+        """
+        self.write_offset()
+        for name, color in record.players:
+            encoded = str(name).encode("utf-8")
+            self._file.write(bytes([len(encoded)]) + encoded + color.encode("ascii"))
+        winner = NO_PLAYER if record.winner is None else record.winner
+        self._file.write(bytes([record.size]) + _encode_record_end(record.moves, record.first, winner,
+                                                                   record.captured, record.size))
+
+
+def _locate_record(data, offset, version):
+    """
+    Takes archive bytes (or a memory map of them), the offset of a game record and the archive version.
+    Returns the players, the board size, the offset of the moves and the offset of END_OF_MOVES.
+    """
+    start = offset
+    players = []
+    for player in range(2):
+        length = data[offset]
+        name = bytes(data[offset + 1:offset + 1 + length]).decode("utf-8")
+        color = chr(data[offset + 1 + length])
+        players.append((name, color))
+        offset += length + 2
+    size = 7
+    if version >= 2:
+        size = data[offset]
+        offset += 1
+    width = get_move_width(size)
+    end_marker = get_end_of_moves(size).to_bytes(width, "big")
+    # a number of a wider record may end with the first bytes of the marker, so only aligned matches count
+    end = data.find(end_marker, offset)
+    while end >= 0 and (end - offset) % width:
+        end = data.find(end_marker, end + 1)
+    if end < 0 or end + 2 + 3 * width > len(data):
+        raise ValueError("truncated game record at offset %d" % start)
+    return players, size, offset, end
+
+
+def decode_game(data, offset, version=VERSION):
+    """
+    Takes archive bytes (or a memory map of them), the offset of a game record and the archive version.
+    Returns the GameRecord and the offset of the next record.
+    """
+    start = offset
+    players, size, offset, end = _locate_record(data, offset, version)
+    width = get_move_width(size)
+    if width == 1:
+        moves = bytes(data[offset:end])
+    else:
+        moves = tuple(int.from_bytes(data[index:index + width], "big") for index in range(offset, end, width))
+    end += width
+    first, winner = data[end:end + 2]
+    captured_a = int.from_bytes(data[end + 2:end + 2 + width], "big")
+    captured_b = int.from_bytes(data[end + 2 + width:end + 2 + 2 * width], "big")
+    if winner == NO_PLAYER:
+        winner = None
+    record = GameRecord(tuple(players), first, moves, winner, (captured_a, captured_b), start, size, version)
+    return record, end + 2 + 2 * width
+
+
+def _check_header(path, data):
+    """
+    Takes the path of an archive and its bytes. Returns the archive version.
+    Raises ValueError if the file is not an archive.
+    """
+    version = data[len(MAGIC)]
+    if data[:len(MAGIC)] != MAGIC or version not in (1, VERSION):
+        raise ValueError("%s is not a version 1 or %d Kuba archive" % (path, VERSION))
+    return version
+
+
+def read_games(path, start=None, stop=None):
+    """
+    Takes the path of an archive, and optionally the offsets where reading starts and stops.
+    Generates the GameRecords of the archive in order. The file is memory-mapped, so only the
+    pages of the records being read are loaded.
+    """
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            version = _check_header(path, data)
+            offset = len(MAGIC) + 1 if start is None else start
+            end = len(data) if stop is None else stop
+            while offset < end:
+                record, offset = decode_game(data, offset, version)
+                yield record
+
+
+def scan_offsets(path):
+    """
+    Takes the path of an archive. Generates the offset of every record by walking from one record
+    to the next, without decoding the moves.
+    """
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            version = _check_header(path, data)
+            offset = len(MAGIC) + 1
+            while offset < len(data):
+                yield offset
+                players, size, moves, end = _locate_record(data, offset, version)
+                offset = end + 2 + 3 * get_move_width(size)
+
+
+def write_index(path):
+    """
+    Takes the path of an archive. Writes its offset index from scan_offsets. Returns the number of records.
+    """
+    count = 0
+    with open(path + INDEX_SUFFIX, "wb") as index:
+        for offset in scan_offsets(path):
+            index.write(struct.pack("<Q", offset))
+            count += 1
+    return count
+
+
+def read_offsets(path, step=1):
+    """
+    Takes the path of an archive and a number of records. Generates the offset of every step-th
+    record, from the first: from the offset index if the archive has one, which only reads those
+    entries of it, otherwise from scan_offsets.
+    """
+    if not os.path.exists(path + INDEX_SUFFIX):
+        for number, offset in enumerate(scan_offsets(path)):
+            if number % step == 0:
+                yield offset
+        return
+    with open(path + INDEX_SUFFIX, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as index:
+            for position in range(0, len(index) - 7, 8 * step):
+                yield struct.unpack_from("<Q", index, position)[0]
+
+
+def replay(record, resync_ko=False):
+    """
+    Takes a GameRecord and whether to resynchronize the ko rule. Replays its moves and rejected
+    calls on a new KubaGame, stopping at the first move that make_move rejects.
+    With resync_ko, a rejected move is tried once more after a rejected call, which keeps the current
+    board for the ko rule so that the move cannot be refused for undoing the opponent's move; use it
+    for version 1 records, which do not hold the rejected calls the ko rule depends on.
+    Returns the game, the number of moves and rejected calls replayed and the number of moves that
+    were only made after resynchronizing.
+    """
+    game = KubaGame(*record.players, size=record.size)
+    rejected = get_rejected(record.size)
+    playerName = record.players[record.first][0]
+    made = 0
+    resynced = 0
+    for code in record.moves:
+        if code == rejected:
+            # any call that validate_move rejects keeps the board for the ko rule the same way
+            game.make_move(playerName, None, None)
+        else:
+            coordinates, direction = decode_move(code, record.size)
+            if not game.make_move(playerName, coordinates, direction):
+                if not resync_ko:
+                    break
+                game.make_move(playerName, None, None)
+                if not game.make_move(playerName, coordinates, direction):
+                    break
+                resynced += 1
+            playerName = game.get_current_turn()
+        made += 1
+    return game, made, resynced
@@ -0,0 +1,145 @@
+# Description: Bulk replay and validation of KubaRecord archives. The archive is cut into shards of a fixed
+# number of games by the record offsets in its offset index, and worker processes replay every game of a
+# shard through KubaGame.make_move, flagging the first point where the replay disagrees with the record: a
+# move that make_move rejects, or a different winner or red capture count at the end. Only a few shards are
+# in flight per worker and workers only send back counts and mismatches, so memory does not grow with the
+# archive. Run it after a rules change to see which stored games it affects.
+#
+# Version 1 records do not hold the rejected calls that the ko rule depends on, so one of their moves can be
+# refused only because the replay's ko history differs from the game's. Such moves are made after
+# resynchronizing the ko rule (see KubaRecord.replay) and the game is counted as resynced, not as a mismatch.
+# Archives without an offset index are scanned in the parent first; --write-index stores the index.
+#
+# Usage: python KubaReplay.py ARCHIVE [--workers N] [--shard-games G] [--max-mismatches M] [--write-index]
+import argparse
+import sys
+import time
+
+from KubaRecord import INDEX_SUFFIX, read_games, read_offsets, replay, write_index
+from KubaSelfPlay import run_bounded
+
+
+def get_shards(path, games_per_shard=1000):
+    """
+    Takes the path of an archive and the number of games per shard.
+    Generates the (start, stop) offsets of the shards in archive order, so that read_games(path,
+    start, stop) reads the games of one shard.
+    """
+    shard_start = None
+    for offset in read_offsets(path, games_per_shard):
+        if shard_start is not None:
+            yield shard_start, offset
+        shard_start = offset
+    if shard_start is not None:
+        yield shard_start, None
+
+
+def check_record(record):
+    """
+    Takes a GameRecord. Replays it, resynchronizing the ko rule for version 1 records, and compares
+    the replay with the record.
+    Returns the number of moves made, the first mismatch as a dict (offset of the record, index of
+    the move, reason, recorded and replayed values), or None if they agree, and the number of moves
+    made after resynchronizing.
+    """
+    game, made, resynced = replay(record, resync_ko=record.version == 1)
+    mismatch = None
+    if made < len(record.moves):
+        mismatch = {"reason": "illegal move", "expected": record.moves[made], "found": None}
+    else:
+        names = (record.players[0][0], record.players[1][0])
+        winner = game.get_winner()
+        winner_index = None if winner is None else names.index(winner)
+        captured = (game.get_captured(names[0]), game.get_captured(names[1]))
+        if winner_index != record.winner:
+            mismatch = {"reason": "winner", "expected": record.winner, "found": winner_index}
+        elif captured != tuple(record.captured):
+            mismatch = {"reason": "captured", "expected": list(record.captured), "found": list(captured)}
+    if mismatch is not None:
+        mismatch["offset"] = record.offset
+        mismatch["move"] = made
+    return made, mismatch, resynced
+
+
+def check_shard(path, start, stop, max_mismatches):
+    """
+    Takes the path of an archive, the offsets of a shard and the most mismatches to return.
+    Replays the games of the shard. Returns a dict with the games, moves made, mismatched games,
+    the first mismatches, the games that only matched after resynchronizing the ko rule and the
+    seconds taken. Runs in a worker process.
+    """
+    begin = time.perf_counter()
+    result = {"games": 0, "moves": 0, "mismatched": 0, "mismatches": [], "resynced": 0}
+    for record in read_games(path, start, stop):
+        made, mismatch, resynced = check_record(record)
+        result["games"] += 1
+        result["moves"] += made
+        if resynced > 0 and mismatch is None:
+            result["resynced"] += 1
+        if mismatch is not None:
+            result["mismatched"] += 1
+            if len(result["mismatches"]) < max_mismatches:
+                result["mismatches"].append(mismatch)
+    result["seconds"] = time.perf_counter() - begin
+    return result
+
+
+def replay_archive(path, workers=None, games_per_shard=1000, max_mismatches=100):
+    """
+    Takes the path of an archive, the number of worker processes, the number of games per shard
+    and the most mismatches to keep.
+    Replays every game of the archive. Returns a dict with the games and moves replayed, the number
+    of mismatched games, the first mismatches in archive order, the number of version 1 games that
+    only matched after resynchronizing the ko rule, the seconds taken and the moves/sec.
+    """
+    start = time.perf_counter()
+    summary = {"games": 0, "moves": 0, "mismatched": 0, "mismatches": [], "resynced": 0}
+
+    def add(result):
+        summary["games"] += result["games"]
+        summary["moves"] += result["moves"]
+        summary["mismatched"] += result["mismatched"]
+        summary["resynced"] += result["resynced"]
+        room = max_mismatches - len(summary["mismatches"])
+        summary["mismatches"].extend(result["mismatches"][:room])
+
+    shards = ((path, shard_start, shard_stop, max_mismatches)
+              for shard_start, shard_stop in get_shards(path, games_per_shard))
+    for result in run_bounded(check_shard, shards, workers):
+        add(result)
+
+    summary["seconds"] = time.perf_counter() - start
+    summary["moves_per_sec"] = summary["moves"] / summary["seconds"] if summary["seconds"] else 0.0
+    return summary
+
+
+def main(argv=None):
+    """
+    Takes the command line arguments. Replays an archive and prints the mismatches and throughput.
+    Returns 1 if any game does not match its record, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(description="Replay a Kuba game archive and check every record.")
+    parser.add_argument("archive")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shard-games", type=int, default=1000, help="games per shard")
+    parser.add_argument("--max-mismatches", type=int, default=100, help="mismatches to print")
+    parser.add_argument("--write-index", action="store_true",
+                        help="write the offset index of the archive first (to ARCHIVE%s)" % INDEX_SUFFIX)
+    args = parser.parse_args(argv)
+
+    if args.write_index:
+        write_index(args.archive)
+    summary = replay_archive(args.archive, args.workers, args.shard_games, args.max_mismatches)
+    for mismatch in summary["mismatches"]:
+        print("offset %d, move %d: %s (recorded %s, replayed %s)" % (
+            mismatch["offset"], mismatch["move"], mismatch["reason"], mismatch["expected"], mismatch["found"]))
+    if summary["resynced"]:
+        print("%d version 1 games only matched after resynchronizing the ko rule, as they have no rejected calls"
+              % summary["resynced"])
+    print("%d games, %d moves, %d mismatched in %.2fs (%.0f moves/sec)" % (
+        summary["games"], summary["moves"], summary["mismatched"], summary["seconds"], summary["moves_per_sec"]))
+    return 1 if summary["mismatched"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# Description: Monte-Carlo rollout evaluator for KubaGame positions. rollout copies a position into a KubaBatch
+# and plays all of its random continuations at once: every step draws a uniformly random move for each game from
+# the vectorized legal move mask, redraws the moves ko forbids, and makes them in one batch call. The results
+# are the win rate of each player, the average red captures and the average length of the continuations.
+# Rollouts are reproducible from their seed. Like KubaBatch, rollout only plays the 7x7 game won with 7 red
+# captures, and raises ValueError for a game of another size.
+#
+# Usage: python KubaRollout.py [--rollouts M] [--seed S] [--max-moves N]
+import argparse
+import time
+
+import numpy as np
+
+from KubaBatch import KubaBatch
+from KubaGame import KubaGame
+from KubaSelfPlay import PLAYERS
+
+
+def choose_moves(legal, rng):
+    """
+    Takes an (N, 196) boolean legal move mask and a NumPy Generator.
+    Returns an (N,) array of uniformly random legal moves (0 for games without one).
+    """
+    keys = rng.random(legal.shape)
+    keys[~legal] = -1.0
+    return keys.argmax(axis=1)
+
+
+def split_moves(moves):
+    """
+    Takes an array of move numbers. Returns the arrays of their rows, columns and direction codes.
+    """
+    squares, directions = np.divmod(moves, 4)
+    rows, columns = np.divmod(squares, 7)
+    return rows, columns, directions
+
+
+def rollout(game, rollouts=1000, seed=0, max_moves=500):
+    """
+    Takes a KubaGame, the number of random continuations to play, a seed and the most moves to
+    play in each. Plays the continuations from the game's position, player A moving first if
+    no one has moved yet. The game is not changed.
+    Returns the results as a dict: number of rollouts, win rate of each player, rate of games
+    without a winner (no legal moves left or max_moves reached), average red captures of each
+    player at the end, and average length in moves. Raises ValueError if the game is not 7x7.
+    """
+    rng = np.random.default_rng(seed)
+    batch = KubaBatch.from_game(game, rollouts)
+    games = np.arange(rollouts)
+    players = batch.get_current_turn().astype(np.intp)
+    players[players < 0] = 0
+    lengths = np.zeros(rollouts, dtype=np.intp)
+    stuck = np.zeros(rollouts, dtype=bool)
+
+    for move_number in range(max_moves):
+        active = (batch.get_winner() < 0) & ~stuck
+        if not active.any():
+            break
+        legal = batch.legal_mask(players) & active[:, None]
+        moves = choose_moves(legal, rng)
+
+        # redraw the moves that would recreate the board ko forbids, before making any, since a
+        # rejected call would change the board ko forbids
+        pending = legal.any(axis=1)
+        stuck |= active & ~pending
+        rows, columns, directions = split_moves(moves)
+        while pending.any():
+            valid = batch.check_moves(players, rows, columns, directions, pending)[0]
+            redraw = pending & ~valid
+            if not redraw.any():
+                break
+            legal[games[redraw], moves[redraw]] = False
+            moves = np.where(redraw, choose_moves(legal, rng), moves)
+            rows, columns, directions = split_moves(moves)
+            stuck |= redraw & ~legal.any(axis=1)
+            pending &= legal.any(axis=1)
+
+        made = batch.step(players, rows, columns, directions, pending)[0]
+        lengths += made
+        players = np.where(made, 1 - players, players)
+
+    name_a = game.get_A()[0]
+    name_b = game.get_B()[0]
+    winner = batch.get_winner()
+    captured = batch.get_captured()
+    return {
+        "rollouts": rollouts,
+        "wins": {name_a: float((winner == 0).mean()), name_b: float((winner == 1).mean())},
+        "no_winner": float((winner < 0).mean()),
+        "captured": {name_a: float(captured[:, 0].mean()), name_b: float(captured[:, 1].mean())},
+        "average_length": float(lengths.mean()),
+    }
+
+
+def main(argv=None):
+    """
+    Takes the command line arguments. Runs rollouts from the starting position and prints the results.
+    """
+    parser = argparse.ArgumentParser(description="Evaluate the KubaGame starting position with random rollouts.")
+    parser.add_argument("--rollouts", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-moves", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    result = rollout(KubaGame(*PLAYERS), args.rollouts, args.seed, args.max_moves)
+    seconds = time.perf_counter() - start
+    print(result)
+    print("%d rollouts in %.3fs" % (args.rollouts, seconds))
+
+
+if __name__ == "__main__":
+    main()
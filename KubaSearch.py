@@ -0,0 +1,335 @@
+# Description: Alpha-beta search player for KubaGame. AlphaBetaPlayer runs an iterative-deepening negamax
+# alpha-beta search in place on the game with make_move/unmake_move, orders moves (transposition table
+# move, then push-offs of red and opponent marbles), caches results in a size-bounded transposition
+# table and stops when the time budget for the move runs out. Given a KubaTablebase, it plays and scores
+# the positions the table covers exactly instead of searching them.
+import time
+
+from KubaTablebase import WIN_VALUE
+
+WIN_SCORE = 1000000             # score of a won position, less the number of moves to the win
+MATE_SCORE = WIN_SCORE - 100000 # scores at least this far from 0 are wins, stored relative to the position
+RED_WEIGHT = 100                # value of each red capture ahead of the opponent
+MARBLE_WEIGHT = 80              # value of each marble more than the opponent has on the board
+
+# transposition table bound types
+EXACT, LOWER, UPPER = 0, 1, 2
+
+CHECK_NODES = 63                # the deadline is checked every 64 nodes, and at every node at ply 0 and 1
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time budget of the move has run out.
+    """
+    pass
+
+
+def score_to_table(score, ply):
+    """
+    Takes a search score and the distance from the root.
+    Returns the score to store in the transposition table, with wins counted from the position itself.
+    """
+    if score >= MATE_SCORE:
+        return score + ply
+    if score <= -MATE_SCORE:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    """
+    Takes a score stored in the transposition table and the distance from the root.
+    Returns it as a search score, with wins counted from the root.
+    """
+    if score >= MATE_SCORE:
+        return score - ply
+    if score <= -MATE_SCORE:
+        return score + ply
+    return score
+
+
+def evaluate_material(game, playerName):
+    """
+    Takes a game and a player name.
+    Returns the static score of the position for the player: red captures and marbles on the
+    board, each compared with the opponent's.
+    """
+    opponent = game.get_opponent(playerName)
+    marble_count = game.get_marble_count()
+    colors = {"W": marble_count[0], "B": marble_count[1]}
+    red = game.get_captured(playerName) - game.get_captured(opponent)
+    marbles = colors[game.get_color(playerName)] - colors[game.get_color(opponent)]
+    return RED_WEIGHT * red + MARBLE_WEIGHT * marbles
+
+
+class TranspositionTable:
+    """
+    The class representing a fixed-size transposition table. Each position hashes to one slot.
+    A slot is replaced if it is empty, was stored by an earlier search, or was searched no deeper
+    than the new entry (depth-preferred replacement with aging).
+    """
+    def __init__(self, size=1 << 16):
+        """
+        Takes the number of slots.
+        """
+        self._size = size
+        self._slots = [None] * size
+        self._generation = 0
+
+    def new_search(self):
+        """
+        Marks the entries stored so far as coming from an earlier search.
+        """
+        self._generation += 1
+
+    def probe(self, key):
+        """
+        Takes a position key. Returns the (depth, value, bound, move) stored for it, or None.
+        """
+        slot = self._slots[hash(key) % self._size]
+        if slot is not None and slot[0] == key:
+            return slot[1:5]
+        return None
+
+    def store(self, key, depth, value, bound, move):
+        """
+        Takes a position key, the depth searched, the value, its bound type and the best move.
+        Stores them if the replacement policy allows it.
+        """
+        index = hash(key) % self._size
+        slot = self._slots[index]
+        if slot is None or slot[0] == key or slot[5] != self._generation or depth >= slot[1]:
+            self._slots[index] = (key, depth, value, bound, move, self._generation)
+
+    def __len__(self):
+        """
+        Returns the number of filled slots.
+        """
+        return self._size - self._slots.count(None)
+
+
+class AlphaBetaPlayer:
+    """
+    The class representing a search player that picks moves for KubaGame.
+    """
+    def __init__(self, time_limit=1.0, max_depth=64, table_size=1 << 16, tablebase=None):
+        """
+        Takes the time budget per move in seconds, the deepest iteration, the transposition table size
+        and an optional endgame Tablebase.
+        """
+        self._time_limit = time_limit
+        self._tablebase = tablebase
+        self._max_depth = max_depth
+        self._table = TranspositionTable(table_size)
+        self._deadline = None
+        self._nodes = 0
+        self._made = 0                  # moves made on the game and not yet taken back
+        self._info = {}
+
+    def get_search_info(self):
+        """
+        Returns a dict about the last search: depth completed, score, nodes searched and seconds taken.
+        """
+        return self._info
+
+    def evaluate(self, game, playerName):
+        """
+        Takes a game and a player name.
+        Returns the static score of the position for the player, from evaluate_material.
+        """
+        return evaluate_material(game, playerName)
+
+    def get_key(self, game):
+        """
+        Takes a game. Returns the transposition table key of its position, which includes the
+        board hash that the next move may not recreate.
+        """
+        history = game.get_pre_oppo_move()
+        if len(history) > 0:
+            return game.position_hash(), history[0]
+        return game.position_hash(), None
+
+    def get_tablebase_score(self, value, ply):
+        """
+        Takes a tablebase value and the distance from the root. Returns it as a search score.
+        """
+        if value > 0:
+            return WIN_SCORE - ply - (WIN_VALUE - value)
+        if value < 0:
+            return -WIN_SCORE + ply + (WIN_VALUE + value)
+        return 0
+
+    def order_moves(self, game, playerName, first_move=None):
+        """
+        Takes a game, the player to move and the move to try first.
+        Returns the player's legal moves: the first move, then moves pushing off red, then moves
+        pushing off an opponent's marble, then the rest.
+        """
+        first = []
+        red_push_offs = []
+        push_offs = []
+        others = []
+        for move in sorted(game.legal_moves(playerName)):
+            if move == first_move:
+                first.append(move)
+                continue
+            pushed_off = game.get_push_off_marble(move[0], move[1])
+            if pushed_off == "R":
+                red_push_offs.append(move)
+            elif pushed_off is not None:
+                push_offs.append(move)
+            else:
+                others.append(move)
+        return first + red_push_offs + push_offs + others
+
+    def choose_move(self, game, playerName):
+        """
+        Takes a game and the name of the player to move.
+        Searches until the time budget runs out and returns the best (coordinates, direction) found,
+        or None if the player has no legal move. The game is left as it was.
+        """
+        start = time.perf_counter()
+        self._deadline = start + self._time_limit
+        self._nodes = 0
+        self._made = 0
+        self._table.new_search()
+
+        moves = self.order_moves(game, playerName)
+        if len(moves) == 0:
+            return None
+        best_move = moves[0]
+        self._info = {"depth": 0, "score": None, "nodes": 0, "seconds": 0.0}
+
+        if self._tablebase is not None:
+            entry = self._tablebase.probe(game)
+            if entry is not None and entry[1] is not None:
+                self._info = {"depth": 0, "score": self.get_tablebase_score(entry[0], 0), "nodes": 0,
+                              "seconds": time.perf_counter() - start, "tablebase": True}
+                return entry[1]
+
+        for depth in range(1, self._max_depth + 1):
+            try:
+                score, move = self.search_root(game, playerName, depth, best_move)
+            except SearchTimeout:
+                # take back the moves of the unfinished iteration
+                while self._made > 0:
+                    game.unmake_move()
+                    self._made -= 1
+                break
+            if move is None:
+                break
+            best_move = move
+            self._info = {"depth": depth, "score": score, "nodes": self._nodes,
+                          "seconds": time.perf_counter() - start}
+            if abs(score) >= WIN_SCORE - self._max_depth:
+                break
+        self._info["nodes"] = self._nodes
+        self._info["seconds"] = time.perf_counter() - start
+        return best_move
+
+    def search_root(self, game, playerName, depth, first_move):
+        """
+        Takes a game, the player to move, the depth and the move to search first.
+        Returns the score of the position and the best move.
+        """
+        alpha = -WIN_SCORE - 1
+        beta = WIN_SCORE + 1
+        opponent = game.get_opponent(playerName)
+        best_move = None
+        for move in self.order_moves(game, playerName, first_move):
+            if not self.make(game, playerName, move):
+                continue
+            score = -self.negamax(game, opponent, depth - 1, -beta, -alpha, 1)
+            self.unmake(game)
+            if best_move is None or score > alpha:
+                alpha = score
+                best_move = move
+        self._table.store(self.get_key(game), depth, alpha, EXACT, best_move)
+        return alpha, best_move
+
+    def negamax(self, game, playerName, depth, alpha, beta, ply):
+        """
+        Takes a game, the player to move, the remaining depth, the alpha-beta window and the
+        distance from the root. Returns the score of the position for the player to move.
+        """
+        self._nodes += 1
+        if (ply <= 1 or self._nodes & CHECK_NODES == 0) and time.perf_counter() > self._deadline:
+            raise SearchTimeout()
+
+        winner = game.get_winner()
+        if winner is not None:
+            if winner == playerName:
+                return WIN_SCORE - ply
+            return -WIN_SCORE + ply
+        if self._tablebase is not None:
+            entry = self._tablebase.probe(game)
+            if entry is not None:
+                return self.get_tablebase_score(entry[0], ply)
+        if depth == 0:
+            return self.evaluate(game, playerName)
+
+        key = self.get_key(game)
+        entry = self._table.probe(key)
+        first_move = None
+        if entry is not None:
+            entry_depth, value, bound, first_move = entry
+            value = score_from_table(value, ply)
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return value
+                if bound == LOWER and value > alpha:
+                    alpha = value
+                elif bound == UPPER and value < beta:
+                    beta = value
+                if alpha >= beta:
+                    return value
+
+        moves = self.order_moves(game, playerName, first_move)
+        if len(moves) == 0:
+            return self.evaluate(game, playerName)
+
+        alpha_start = alpha
+        opponent = game.get_opponent(playerName)
+        best_score = -WIN_SCORE - 1
+        best_move = None
+        for move in moves:
+            if not self.make(game, playerName, move):
+                continue
+            score = -self.negamax(game, opponent, depth - 1, -beta, -alpha, ply + 1)
+            self.unmake(game)
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if best_score <= alpha_start:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        if best_move is None:
+            return self.evaluate(game, playerName)
+        self._table.store(key, depth, score_to_table(best_score, ply), bound, best_move)
+        return best_score
+
+    def make(self, game, playerName, move):
+        """
+        Takes a game, a player name and a legal move. Makes the move on the game.
+        Returns True, or False if make_move rejected the move.
+        """
+        if not game.make_move(playerName, move[0], move[1]):
+            return False
+        self._made += 1
+        return True
+
+    def unmake(self, game):
+        """
+        Takes a game. Takes back the last move made by the search.
+        """
+        game.unmake_move()
+        self._made -= 1
@@ -0,0 +1,157 @@
+# Description: Parallel self-play runner for KubaGame. Plays many independent games between two move
+# policies across a ProcessPoolExecutor, streams the game records back in chunks and aggregates them.
+# A move policy is a picklable callable policy(game, playerName, rng) that returns a
+# (coordinates, direction) pair, or None if it has no move to make. A policy with a close() method, such
+# as a PlayerPolicy holding worker processes, is closed once the worker has played its games.
+import os
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from KubaGame import KubaGame
+
+PLAYERS = (("A", "W"), ("B", "B"))
+
+
+def random_policy(game, playerName, rng):
+    """
+    Takes a game, the name of the player to move and a random.Random.
+    Returns a uniformly random legal move, or None if the player has no legal move.
+    """
+    moves = sorted(game.legal_moves(playerName))
+    if len(moves) == 0:
+        return None
+    return rng.choice(moves)
+
+
+def game_rng(seed, index):
+    """
+    Takes the seed of a run and the index of a game in it.
+    Returns the random.Random the game is played with, so each game is reproducible on its own.
+    """
+    return random.Random("%d:%d" % (seed, index))
+
+
+def play_game(policy_a, policy_b, rng, max_moves=500, players=PLAYERS):
+    """
+    Takes the policies of player A and player B, a random.Random, the most moves to play and
+    the two (player name, color) tuples. Plays one game, player A moving first.
+    Returns the game record as a dict: winner (None for no winner), length in moves, the red
+    marbles captured by each player from get_captured, and why the game ended.
+    """
+    game = KubaGame(*players)
+    name_a = players[0][0]
+    name_b = players[1][0]
+    policies = {name_a: policy_a, name_b: policy_b}
+    playerName = name_a
+    length = 0
+    reason = "max_moves"
+
+    while length < max_moves:
+        move = policies[playerName](game, playerName, rng)
+        if move is None:
+            reason = "no_moves"
+            break
+        if not game.make_move(playerName, move[0], move[1]):
+            reason = "illegal_move"
+            break
+        length += 1
+        if game.get_winner() is not None:
+            reason = "win"
+            break
+        playerName = game.get_current_turn()
+
+    return {
+        "winner": game.get_winner(),
+        "length": length,
+        "captured": {name_a: game.get_captured(name_a), name_b: game.get_captured(name_b)},
+        "reason": reason,
+    }
+
+
+def close_policy(policy):
+    """
+    Takes a move policy. Calls its close() method, if it has one.
+    """
+    close = getattr(policy, "close", None)
+    if close is not None:
+        close()
+
+
+def run_bounded(function, argument_tuples, workers=None):
+    """
+    Takes a picklable function, an iterable of tuples of arguments and the number of worker processes.
+    Calls the function with every tuple of arguments across a ProcessPoolExecutor and generates the
+    results in the order of the tuples. Only two calls per worker are in flight at a time, so memory
+    does not grow with the number of calls and the tuples can be generated as they are needed.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for arguments in argument_tuples:
+            pending.append(executor.submit(function, *arguments))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def play_chunk(policy_a, policy_b, seed, start, count, max_moves):
+    """
+    Takes the policies, the seed of the run, the index of the first game and the number of games.
+    Plays the games one after another and closes the policies. Returns their records, each with its game index.
+    """
+    records = []
+    try:
+        for index in range(start, start + count):
+            record = play_game(policy_a, policy_b, game_rng(seed, index), max_moves)
+            record["game"] = index
+            records.append(record)
+    finally:
+        close_policy(policy_a)
+        close_policy(policy_b)
+    return records
+
+
+def run_self_play(policy_a, policy_b=None, games=1000, seed=0, workers=None, chunk_size=50, max_moves=500):
+    """
+    Takes the policies of player A and player B (player B plays policy_a if policy_b is None),
+    the number of games, the seed of the run, the number of worker processes, the number of
+    games per chunk and the most moves per game.
+    Generates lists of game records in game order, one list per chunk. Only a few chunks per
+    worker are in flight at a time, so memory does not grow with the number of games.
+    Results only depend on the seed, not on the number of workers.
+    """
+    if policy_b is None:
+        policy_b = policy_a
+    chunks = ((policy_a, policy_b, seed, start, min(chunk_size, games - start), max_moves)
+              for start in range(0, games, chunk_size))
+    yield from run_bounded(play_chunk, chunks, workers)
+
+
+def summarize(chunks):
+    """
+    Takes an iterable of lists of game records, e.g. from run_self_play.
+    Returns the aggregated results as a dict: number of games, wins per player, games without a
+    winner, average game length, and total red captures per player.
+    """
+    summary = {"games": 0, "wins": {}, "no_winner": 0, "average_length": 0.0, "captured": {}}
+    total_length = 0
+    for records in chunks:
+        for record in records:
+            summary["games"] += 1
+            total_length += record["length"]
+            if record["winner"] is None:
+                summary["no_winner"] += 1
+            else:
+                summary["wins"][record["winner"]] = summary["wins"].get(record["winner"], 0) + 1
+            for name, captured in record["captured"].items():
+                summary["captured"][name] = summary["captured"].get(name, 0) + captured
+    if summary["games"] > 0:
+        summary["average_length"] = total_length / summary["games"]
+    return summary
+
+
+if __name__ == "__main__":
+    print(summarize(run_self_play(random_policy, games=200)))
@@ -0,0 +1,331 @@
+# Description: Asyncio game server hosting many concurrent KubaGame sessions in one event loop, and a load-test
+# client for it. Clients talk line-delimited JSON over local TCP or a Unix socket: every request is one JSON
+# object on one line, {"id": ..., "op": ..., ...}, and gets one response line, {"id": ..., "ok": true,
+# "result": ...} or {"id": ..., "ok": false, "error": ...}.
+#
+# Operations: new_game (players), make_move (session, player, coordinates, direction), get_marble (session,
+# coordinates), get_current_turn (session), get_winner (session), legal_moves (session, player), close_game
+# (session). Sessions idle for longer than the idle timeout are evicted. A request that is not a JSON object, has
+# coordinates that are not two integers on the board, or fails in any other way gets an "ok": false response.
+#
+# Requests run without awaiting anything, so the one event loop already serializes the requests on a session,
+# and sessions need no locks.
+#
+# Usage: python KubaServer.py serve [--host H] [--port P | --unix PATH] [--idle-timeout S]
+#        python KubaServer.py loadtest [--host H] [--port P | --unix PATH] [--connections N] [--moves M]
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from KubaGame import KubaGame
+
+
+def get_coordinates(request, game):
+    """
+    Takes a request and the game of its session.
+    Returns the request's coordinates as a tuple. Raises ValueError if they are not two integers on the board.
+    """
+    coordinates = request["coordinates"]
+    size = game.get_size()
+    if (not isinstance(coordinates, list) or len(coordinates) != 2
+            or any(type(value) is not int or not 0 <= value < size for value in coordinates)):
+        raise ValueError("coordinates must be two integers from 0 to %d" % (size - 1))
+    return tuple(coordinates)
+
+
+class Session:
+    """
+    The class representing one hosted game and when it was last used.
+    """
+    def __init__(self, game, now):
+        """
+        Takes the game and the current event loop time.
+        """
+        self.game = game
+        self.last_used = now
+
+
+class KubaServer:
+    """
+    The class representing the session server.
+    """
+    def __init__(self, idle_timeout=600.0):
+        """
+        Takes the number of seconds a session may stay idle before it is evicted.
+        """
+        self._idle_timeout = idle_timeout
+        self._sessions = {}
+        self._session_ids = itertools.count(1)
+        self._servers = []
+        self._evictor = None
+
+    def get_session_count(self):
+        """
+        Returns the number of hosted sessions.
+        """
+        return len(self._sessions)
+
+    async def start_tcp(self, host="127.0.0.1", port=0):
+        """
+        Takes a host and port (0 picks a free port). Starts listening. Returns the bound port.
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        self.start_evictor()
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    async def start_unix(self, path):
+        """
+        Takes the path of a Unix socket. Starts listening on it.
+        """
+        server = await asyncio.start_unix_server(self.handle_connection, path)
+        self.start_evictor()
+        self._servers.append(server)
+
+    async def serve_forever(self):
+        """
+        Serves until cancelled.
+        """
+        await asyncio.gather(*(server.serve_forever() for server in self._servers))
+
+    async def close(self):
+        """
+        Stops listening and stops evicting sessions.
+        """
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+        if self._evictor is not None:
+            self._evictor.cancel()
+            self._evictor = None
+
+    def start_evictor(self):
+        """
+        Starts the background task that evicts idle sessions, if it is not running.
+        """
+        if self._evictor is None:
+            self._evictor = asyncio.get_running_loop().create_task(self.evict_idle_sessions())
+
+    async def evict_idle_sessions(self):
+        """
+        Every half idle timeout, removes the sessions that have been idle for longer than the idle timeout.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._idle_timeout / 2)
+            deadline = loop.time() - self._idle_timeout
+            for session_id in [key for key, session in self._sessions.items() if session.last_used < deadline]:
+                del self._sessions[session_id]
+
+    async def handle_connection(self, reader, writer):
+        """
+        Takes the streams of a client connection. Answers its requests line by line until it disconnects.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    response = {"id": None, "ok": False, "error": "bad request: %s" % error}
+                else:
+                    response = await self.handle_request(request)
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request):
+        """
+        Takes a decoded request. Runs it and returns the response,
+        with "ok": false if the request is not an object or running it raised.
+        """
+        if not isinstance(request, dict):
+            return {"id": None, "ok": False, "error": "bad request: not a JSON object"}
+        try:
+            return await self.run_request(request)
+        except Exception as error:
+            return {"id": request.get("id"), "ok": False,
+                    "error": "bad request: %s: %s" % (type(error).__name__, error)}
+
+    async def run_request(self, request):
+        """
+        Takes a request object. Runs it and returns the response. Raises if the request is malformed.
+        """
+        request_id = request.get("id")
+        op = request.get("op")
+        loop = asyncio.get_running_loop()
+
+        if op == "new_game":
+            players = [tuple(player) for player in request["players"]]
+            if len(players) != 2 or any(len(player) != 2 for player in players):
+                raise ValueError("players must be two [name, color] pairs")
+            session_id = next(self._session_ids)
+            self._sessions[session_id] = Session(KubaGame(*players), loop.time())
+            return {"id": request_id, "ok": True, "result": session_id}
+
+        session = self._sessions.get(request.get("session"))
+        if session is None:
+            return {"id": request_id, "ok": False, "error": "no such session"}
+        session.last_used = loop.time()
+
+        game = session.game
+        if op == "make_move":
+            result = game.make_move(request["player"], get_coordinates(request, game), request["direction"])
+        elif op == "get_marble":
+            result = game.get_marble(get_coordinates(request, game))
+        elif op == "get_current_turn":
+            result = game.get_current_turn()
+        elif op == "get_winner":
+            result = game.get_winner()
+        elif op == "legal_moves":
+            result = [[list(coordinates), direction] for coordinates, direction in
+                      game.legal_moves(request["player"])]
+        elif op == "close_game":
+            del self._sessions[request["session"]]
+            result = True
+        else:
+            return {"id": request_id, "ok": False, "error": "unknown op %r" % op}
+        return {"id": request_id, "ok": True, "result": result}
+
+
+class KubaClient:
+    """
+    The class representing a client connection to a KubaServer.
+    """
+    def __init__(self, reader, writer):
+        """
+        Takes the streams of an open connection.
+        """
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count(1)
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=None, path=None):
+        """
+        Takes a host and port, or the path of a Unix socket. Returns a connected client.
+        """
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def call(self, op, **arguments):
+        """
+        Takes an operation and its arguments. Sends the request and returns the result.
+        Raises RuntimeError if the server answers with an error.
+        """
+        request = dict(arguments, id=next(self._ids), op=op)
+        self._writer.write(json.dumps(request).encode("utf-8") + b"\n")
+        await self._writer.drain()
+        response = json.loads(await self._reader.readline())
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    async def close(self):
+        """
+        Closes the connection.
+        """
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+async def play_load(client, moves, rng, latencies):
+    """
+    Takes a client, the number of moves to play, a random.Random and a list for latencies.
+    Plays random legal moves in new games on the server, chosen on a local copy of each game,
+    adding the seconds each make_move took to the latencies. Returns the number of moves made.
+    """
+    players = (("A", "W"), ("B", "B"))
+    made = 0
+    while made < moves:
+        session = await client.call("new_game", players=[list(player) for player in players])
+        local = KubaGame(*players)
+        playerName = "A"
+        while made < moves and local.get_winner() is None:
+            legal = sorted(local.legal_moves(playerName))
+            if len(legal) == 0:
+                break
+            coordinates, direction = rng.choice(legal)
+            start = time.perf_counter()
+            await client.call("make_move", session=session, player=playerName,
+                              coordinates=list(coordinates), direction=direction)
+            latencies.append(time.perf_counter() - start)
+            local.make_move(playerName, coordinates, direction)
+            playerName = local.get_current_turn()
+            made += 1
+        await client.call("close_game", session=session)
+    return made
+
+
+async def load_test(host="127.0.0.1", port=None, path=None, connections=50, moves=200, seed=0):
+    """
+    Takes the server address, the number of concurrent connections, the moves per connection and a seed.
+    Plays random games on all connections at once. Returns a dict with moves, seconds, moves/sec
+    and the p50 and p99 make_move latencies in seconds.
+    """
+    clients = [await KubaClient.connect(host, port, path) for index in range(connections)]
+    latencies = []
+    start = time.perf_counter()
+    made = await asyncio.gather(*(play_load(client, moves, random.Random(seed + index), latencies)
+                                  for index, client in enumerate(clients)))
+    seconds = time.perf_counter() - start
+    for client in clients:
+        await client.close()
+    latencies.sort()
+    return {
+        "moves": sum(made),
+        "seconds": seconds,
+        "moves_per_sec": sum(made) / seconds if seconds else 0.0,
+        "p50_latency": latencies[len(latencies) // 2] if latencies else 0.0,
+        "p99_latency": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] if latencies else 0.0,
+    }
+
+
+async def serve(host, port, path, idle_timeout):
+    """
+    Takes the address to listen on and the idle timeout. Runs a server until cancelled.
+    """
+    server = KubaServer(idle_timeout)
+    if path is not None:
+        await server.start_unix(path)
+        print("serving on %s" % path)
+    else:
+        port = await server.start_tcp(host, port)
+        print("serving on %s:%d" % (host, port))
+    await server.serve_forever()
+
+
+def main(argv=None):
+    """
+    Takes the command line arguments. Runs the server or the load test.
+    """
+    parser = argparse.ArgumentParser(description="Host KubaGame sessions or load-test a host.")
+    parser.add_argument("mode", choices=("serve", "loadtest"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="path of a Unix socket to use instead of TCP")
+    parser.add_argument("--idle-timeout", type=float, default=600.0)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--moves", type=int, default=200, help="moves per connection")
+    args = parser.parse_args(argv)
+
+    if args.mode == "serve":
+        asyncio.run(serve(args.host, args.port, args.unix, args.idle_timeout))
+    else:
+        print(asyncio.run(load_test(args.host, args.port, args.unix, args.connections, args.moves)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# Description: Fan-out of KubaGame move events to many spectators. SpectatorHub observes one game and turns every
+# MoveEvent into a compact JSON-ready delta (the changed cells, the marble pushed off, the red captures and the
+# next turn) with a sequence number. Each spectator reads from its own bounded asyncio queue: a spectator that
+# joins late, or falls so far behind that its queue fills up, first gets a snapshot of the whole board and then
+# the deltas that follow it, so the game never waits for its slowest viewer. Producers that prefer to wait for
+# the spectators instead can await drain.
+#
+# Message formats:
+#   {"type": "snapshot", "seq": n, "board": [one string per row], "captured": {name: count}, "turn": ...,
+#    "winner": ...}
+#   {"type": "move" or "undo", "seq": n, "player": ..., "coordinates": [row, column], "direction": ...,
+#    "cells": [[row, column, marble], ...], "pushed_off": ..., "captured": {name: count}, "turn": ..., "winner": ...}
+import asyncio
+
+
+class Spectator:
+    """
+    The class representing one spectator's bounded queue of messages.
+    """
+    def __init__(self, maxsize):
+        """
+        Takes the most messages to hold before the spectator is resynchronized with a snapshot.
+        """
+        self._queue = asyncio.Queue(maxsize)
+        self._resyncs = 0
+
+    def get_resync_count(self):
+        """
+        Returns how many times the spectator fell behind and was sent a new snapshot.
+        """
+        return self._resyncs
+
+    def qsize(self):
+        """
+        Returns the number of messages waiting.
+        """
+        return self._queue.qsize()
+
+    async def get(self):
+        """
+        Returns the next message, waiting for one if there is none.
+        """
+        message = await self._queue.get()
+        self._queue.task_done()
+        return message
+
+    def get_nowait(self):
+        """
+        Returns the next message. Raises asyncio.QueueEmpty if there is none.
+        """
+        message = self._queue.get_nowait()
+        self._queue.task_done()
+        return message
+
+    def send(self, message, snapshot):
+        """
+        Takes a message and a function returning the current snapshot. Queues the message; if the
+        queue is full, drops everything queued and queues a snapshot instead, which already
+        includes the message.
+        """
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self.get_nowait()
+            self._queue.put_nowait(snapshot())
+            self._resyncs += 1
+
+    async def join(self):
+        """
+        Waits until every queued message has been read.
+        """
+        await self._queue.join()
+
+
+class SpectatorHub:
+    """
+    The class representing the spectators of one game.
+    """
+    def __init__(self, game, maxsize=64):
+        """
+        Takes a KubaGame and the queue size of each spectator. Starts observing the game.
+        """
+        self._game = game
+        self._maxsize = maxsize
+        self._spectators = []
+        self._seq = 0
+        game.add_observer(self.publish)
+
+    def close(self):
+        """
+        Stops observing the game.
+        """
+        self._game.remove_observer(self.publish)
+
+    def get_spectator_count(self):
+        """
+        Returns the number of spectators.
+        """
+        return len(self._spectators)
+
+    def get_snapshot(self):
+        """
+        Returns the snapshot message of the game as it is now.
+        """
+        game = self._game
+        name_a = game.get_A()[0]
+        name_b = game.get_B()[0]
+        size = game.get_size()
+        board = ["".join(game.get_marble((row, column)) for column in range(size)) for row in range(size)]
+        return {"type": "snapshot", "seq": self._seq, "board": board,
+                "captured": {name_a: game.get_captured(name_a), name_b: game.get_captured(name_b)},
+                "turn": game.get_current_turn(), "winner": game.get_winner()}
+
+    def subscribe(self):
+        """
+        Returns a new Spectator, whose first message is the snapshot of the game.
+        """
+        spectator = Spectator(self._maxsize)
+        spectator.send(self.get_snapshot(), self.get_snapshot)
+        self._spectators.append(spectator)
+        return spectator
+
+    def unsubscribe(self, spectator):
+        """
+        Takes a Spectator from subscribe and stops sending it messages.
+        """
+        self._spectators.remove(spectator)
+
+    def publish(self, event):
+        """
+        Takes a MoveEvent. Sends its delta message to every spectator. Rejected calls change no
+        cells and are not sent.
+        """
+        if event.rejected:
+            return
+        self._seq += 1
+        message = {"type": "undo" if event.undo else "move", "seq": self._seq, "player": event.player,
+                   "coordinates": list(event.coordinates), "direction": event.direction,
+                   "cells": [list(cell) for cell in event.cells], "pushed_off": event.pushed_off,
+                   "captured": event.captured, "turn": event.turn, "winner": event.winner}
+        for spectator in self._spectators:
+            spectator.send(message, self.get_snapshot)
+
+    async def drain(self):
+        """
+        Waits until every spectator has read every message sent so far.
+        """
+        await asyncio.gather(*(spectator.join() for spectator in list(self._spectators)))
+
+
+def apply_message(board, message):
+    """
+    Takes a spectator's board as a list of rows of marbles (or None before the first message)
+    and a message. Returns the board after the message.
+    """
+    if message["type"] == "snapshot":
+        return [list(row) for row in message["board"]]
+    for row, column, marble in message["cells"]:
+        board[row][column] = marble
+    return board
@@ -0,0 +1,218 @@
+# Description: Symmetry-aware canonical keys for KubaGame positions. The rules do not change under the 8
+# rotations and reflections of the square board, nor under swapping the W and B marbles (with the side to
+# move and the captures). canonical_key maps a position to the smallest of its 16 images, so symmetric
+# positions share one key, and SymmetryCache memoizes values under that key with LRU eviction.
+#
+# A transform is a number from 0 to 15: transform % 8 picks the identity, the rotation by 90, 180 or 270
+# degrees, the flip of the columns or the rows, the transpose or the anti-transpose, and transforms 8 to 15
+# also swap the colors.
+from collections import OrderedDict
+
+DIRECTION_STEPS = {"B": (1, 0), "F": (-1, 0), "L": (0, -1), "R": (0, 1)}
+_SWAP_COLORS = str.maketrans("WB", "BW")
+_permutations = {}              # board size -> list of 8 square permutations
+
+
+def transform_square(coordinates, transform, size):
+    """
+    Takes coordinates, a transform and the board size.
+    Returns the coordinates the square moves to under the transform.
+    """
+    row, column = coordinates
+    last = size - 1
+    geometry = transform % 8
+    if geometry == 0:
+        return row, column
+    if geometry == 1:
+        return column, last - row
+    if geometry == 2:
+        return last - row, last - column
+    if geometry == 3:
+        return last - column, row
+    if geometry == 4:
+        return row, last - column
+    if geometry == 5:
+        return last - row, column
+    if geometry == 6:
+        return column, row
+    return last - column, last - row
+
+
+def transform_move(coordinates, direction, transform, size):
+    """
+    Takes the coordinates and direction of a move, a transform and the board size.
+    Returns the (coordinates, direction) of the same move on the transformed board.
+    """
+    row_step, column_step = DIRECTION_STEPS[direction]
+    center = size // 2
+    start = transform_square((center, center), transform, size)
+    ahead = transform_square((center + row_step, center + column_step), transform, size)
+    step = (ahead[0] - start[0], ahead[1] - start[1])
+    for new_direction, new_step in DIRECTION_STEPS.items():
+        if new_step == step:
+            return transform_square(coordinates, transform, size), new_direction
+
+
+def inverse_transform(transform):
+    """
+    Takes a transform. Returns the transform that undoes it.
+    """
+    geometry = transform % 8
+    if geometry == 1:
+        geometry = 3
+    elif geometry == 3:
+        geometry = 1
+    return transform - transform % 8 + geometry
+
+
+def get_permutations(size):
+    """
+    Takes the board size.
+    Returns, for each of the 8 geometries, the list giving for every square of the transformed
+    board (in row-major order) the index of the square it comes from.
+    """
+    if size not in _permutations:
+        permutations = []
+        for geometry in range(8):
+            permutation = [0] * (size * size)
+            for row in range(size):
+                for column in range(size):
+                    new_row, new_column = transform_square((row, column), geometry, size)
+                    permutation[new_row * size + new_column] = row * size + column
+            permutations.append(permutation)
+        _permutations[size] = permutations
+    return _permutations[size]
+
+
+def transform_position(board, turn, captures, transform):
+    """
+    Takes a board as a string of marbles in row-major order, the color to move (or None),
+    a dict of red captures by color and a transform.
+    Returns the transformed (board, turn, captures).
+    """
+    size = int(round(len(board) ** 0.5))
+    board = "".join([board[index] for index in get_permutations(size)[transform % 8]])
+    if transform >= 8:
+        board = board.translate(_SWAP_COLORS)
+        if turn is not None:
+            turn = turn.translate(_SWAP_COLORS)
+        captures = {"W": captures["B"], "B": captures["W"]}
+    return board, turn, captures
+
+
+def canonicalize(board, turn, captures):
+    """
+    Takes a board as a string of marbles in row-major order, the color to move (or None) and
+    a dict of red captures by color.
+    Returns the canonical key of the position and the transform that maps the position to it.
+    Symmetric positions have the same key.
+    """
+    size = int(round(len(board) ** 0.5))
+    best_key = None
+    best_transform = 0
+    for geometry, permutation in enumerate(get_permutations(size)):
+        image = "".join([board[index] for index in permutation])
+        key = (image, turn, captures["W"], captures["B"])
+        if best_key is None or key < best_key:
+            best_key = key
+            best_transform = geometry
+        swapped_turn = turn.translate(_SWAP_COLORS) if turn is not None else None
+        key = (image.translate(_SWAP_COLORS), swapped_turn, captures["B"], captures["W"])
+        if key < best_key:
+            best_key = key
+            best_transform = geometry + 8
+    return best_key, best_transform
+
+
+def get_position(game):
+    """
+    Takes a KubaGame.
+    Returns its (board, turn, captures): the board as a string in row-major order, the color to
+    move (None before the first move) and a dict of red captures by color.
+    """
+    size = game.get_size()
+    board = "".join([game.get_marble((row, column)) for row in range(size) for column in range(size)])
+    name_a, color_a = game.get_A()
+    name_b, color_b = game.get_B()
+    captures = {color_a: game.get_captured(name_a), color_b: game.get_captured(name_b)}
+    return board, game.get_color(game.get_current_turn()), captures
+
+
+def canonical_key(game):
+    """
+    Takes a KubaGame.
+    Returns the canonical key of its position and the transform that maps the position to it.
+    The key does not include the board the next move may not recreate.
+    """
+    return canonicalize(*get_position(game))
+
+
+class SymmetryCache:
+    """
+    The class representing a bounded memo of values by canonical position key.
+    The least recently used entry is evicted when the cache is full.
+    """
+    def __init__(self, maxsize=100000):
+        """
+        Takes the most entries to keep.
+        """
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, default=None):
+        """
+        Takes a canonical key. Returns its value, or the default if it is not cached.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return self._entries[key]
+        self._misses += 1
+        return default
+
+    def put(self, key, value):
+        """
+        Takes a canonical key and a value. Caches the value, evicting the least recently used entry if full.
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, game, compute):
+        """
+        Takes a KubaGame and a function compute(game).
+        Returns the cached value of the game's canonical position, computing and caching it
+        first if it is not cached. The value must not depend on the orientation or colors
+        of the position; use canonical_key and transform_move for values that do.
+        """
+        key = canonical_key(game)[0]
+        if key in self._entries:
+            return self.get(key)
+        self._misses += 1
+        value = compute(game)
+        self.put(key, value)
+        return value
+
+    def get_stats(self):
+        """
+        Returns a dict of the entries, maximum size, hits and misses of the cache.
+        """
+        return {"entries": len(self._entries), "maxsize": self._maxsize,
+                "hits": self._hits, "misses": self._misses}
+
+    def clear(self):
+        """
+        Removes every entry and resets the hit and miss counts.
+        """
+        self._entries.clear()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        """
+        Returns the number of cached entries.
+        """
+        return len(self._entries)
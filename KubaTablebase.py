@@ -0,0 +1,429 @@
+# Description: Endgame tablebase for KubaGame. build solves every position with at most K marbles on the
+# board by retrograde analysis (synchronous passes over the precomputed moves of each position, from the
+# fewest marbles up), following the rules of make_move and get_winner, and writes the results to a compact
+# file. Tablebase memory-maps the file and looks positions up by combinatorial index while playing. Only the
+# 7x7 game won with 7 red captures is covered; probing a game of another size or red target returns None.
+#
+# A position is the board, the color to move and the red captures of each color. The captures add up to
+# 13 less the reds on the board, so each class of (white, black, red) marble counts only has a few capture
+# splits. Values are from the side to move: WIN_VALUE less the plies to a forced win, minus that for a forced
+# loss, and 0 for a draw (neither side can force a win, or the side to move is stuck without a legal move).
+#
+# Ko: a move may not recreate the board before the opponent's last move. Each entry keeps the value and move
+# of the best move and of the best other move, so a lookup whose best move is forbidden by ko uses the other.
+#
+# Pass n of the solver gives every position its value searched n plies deep, so wins of up to n plies are
+# exact once n passes are done. Without ko the values would settle after as many passes as the longest forced
+# win; the ko dependency on the best children can keep flipping, so the passes are capped at --max-passes, after
+# which wins longer than the cap may be stored as draws. The progress function is told about every pass.
+#
+# File layout: header (magic b"KUBT", version, K, number of classes), one record per class (white, black and
+# red counts, least white captures, number of capture splits, index of its first entry), then one entry per
+# position: value, value without the best move, best move and second best move (moves as in KubaRecord).
+#
+# Usage: python KubaTablebase.py PATH [--marbles K] [--max-passes N]
+import argparse
+import itertools
+import math
+import mmap
+import struct
+import sys
+import time
+from array import array
+
+from KubaGame import KubaGame
+from KubaRecord import encode_move, decode_move
+from KubaSymmetry import get_position
+
+MAGIC = b"KUBT"
+VERSION = 1
+TOTAL_RED = 13                  # red marbles in a game
+WIN_RED = 7                     # red captures that win
+BOARD_SIZE = 7                  # rows and columns of the boards in the table
+MAX_MARBLES = 8                 # most marbles of one color
+WIN_VALUE = 30000               # value of a won position, less the plies to the win
+MAX_PASSES = 200                # most solver passes per number of marbles
+NO_MOVE = 0xFF
+TERMINAL = -1                   # successor of a move that wins at once
+SIDES = ("W", "B")
+
+_HEADER = struct.Struct("<4sBBH")       # magic, version, most marbles, number of classes
+_CLASS = struct.Struct("<BBBBBI")       # white, black, red, least white captures, capture splits, first entry
+_ENTRY = struct.Struct("<hhBB")         # value, value without the best move, best move, second best move
+
+
+def get_classes(max_marbles):
+    """
+    Takes the most marbles on the board.
+    Returns the (white, black, red, least white captures, capture splits) of every class of positions
+    that is not over yet, in order of the number of marbles.
+    """
+    classes = []
+    for marbles in range(3, max_marbles + 1):
+        for white in range(1, min(MAX_MARBLES, marbles - 2) + 1):
+            for black in range(1, min(MAX_MARBLES, marbles - white - 1) + 1):
+                red = marbles - white - black
+                captured = TOTAL_RED - red
+                least = max(0, captured - (WIN_RED - 1))
+                most = min(WIN_RED - 1, captured)
+                if red <= TOTAL_RED and least <= most:
+                    classes.append((white, black, red, least, most - least + 1))
+    return classes
+
+
+def get_colorings(white, black, red):
+    """
+    Takes the marble counts of a class.
+    Returns a dict mapping every string of the marbles on the occupied squares (in square order)
+    to its index.
+    """
+    colorings = sorted(set(itertools.permutations("W" * white + "B" * black + "R" * red)))
+    return {"".join(coloring): index for index, coloring in enumerate(colorings)}
+
+
+def rank_squares(squares):
+    """
+    Takes the sorted indexes (row * 7 + column) of the occupied squares.
+    Returns their rank among all sets of that many squares (combinatorial number system).
+    """
+    rank = 0
+    for count, square in enumerate(squares):
+        rank += math.comb(square, count + 1)
+    return rank
+
+
+class TablebaseLayout:
+    """
+    The class representing where each position is stored in a table of the given classes.
+    """
+    def __init__(self, classes, firsts=None):
+        """
+        Takes the classes from get_classes and, if read from a file, the index of each class's first entry.
+        """
+        self._classes = {}
+        size = 0
+        for number, (white, black, red, least, splits) in enumerate(classes):
+            colorings = get_colorings(white, black, red)
+            first = size if firsts is None else firsts[number]
+            self._classes[(white, black, red)] = (first, colorings, least, splits)
+            size = first + math.comb(49, white + black + red) * len(colorings) * splits * 2
+        self._size = size
+
+    def get_size(self):
+        """
+        Returns the number of entries of the table.
+        """
+        return self._size
+
+    def get_class_range(self, white, black, red):
+        """
+        Takes the marble counts of a class. Returns the indexes of its first entry and the one after its last.
+        """
+        first, colorings, least, splits = self._classes[(white, black, red)]
+        return first, first + math.comb(49, white + black + red) * len(colorings) * splits * 2
+
+    def index(self, squares, coloring, turn, white_captured):
+        """
+        Takes the sorted indexes of the occupied squares, the string of their marbles, the color to move
+        and the red captures of white. Returns the index of the position, or None if it is not in the table.
+        """
+        klass = self._classes.get((coloring.count("W"), coloring.count("B"), coloring.count("R")))
+        if klass is None:
+            return None
+        first, colorings, least, splits = klass
+        if not least <= white_captured < least + splits:
+            return None
+        position = rank_squares(squares) * len(colorings) + colorings[coloring]
+        return first + ((position * splits + white_captured - least) * 2 + SIDES.index(turn))
+
+
+def get_child_value(child_value):
+    """
+    Takes the value of a position to its side to move. Returns its value to the player who moved into it.
+    """
+    if child_value > 0:
+        return -child_value + 1
+    if child_value < 0:
+        return -child_value - 1
+    return 0
+
+
+class TablebaseBuilder:
+    """
+    The class representing the generation of a table of every position with at most a given number of marbles.
+    """
+    def __init__(self, max_marbles, progress=None, max_passes=MAX_PASSES):
+        """
+        Takes the most marbles on the board, a function progress(message) told about each pass and each
+        number of marbles solved, and the most solver passes per number of marbles.
+        """
+        self._max_marbles = max_marbles
+        self._max_passes = max_passes
+        self._classes = get_classes(max_marbles)
+        self._layout = TablebaseLayout(self._classes)
+        self._progress = progress
+        size = self._layout.get_size()
+        self._values = array("h", bytes(2 * size))
+        self._second_values = array("h", bytes(2 * size))
+        self._moves = array("B", [NO_MOVE]) * size
+        self._second_moves = array("B", [NO_MOVE]) * size
+        self._best_children = array("i", [TERMINAL]) * size     # position the best move leads to
+        self._game = KubaGame(("W", "W"), ("B", "B"))           # players are named after their colors
+
+    def get_successors(self, marbles, turn, white_captured):
+        """
+        Takes a position as a dict of marbles by square index, the color to move and white's red captures.
+        Returns the list of (move, successor index) of its legal moves, TERMINAL for a move that wins.
+        """
+        board = [["X"] * 7 for row in range(7)]
+        for square, marble in marbles.items():
+            board[square // 7][square % 7] = marble
+        red = sum(1 for marble in marbles.values() if marble == "R")
+        game = self._game
+        game.set_position(board, turn, {"W": white_captured, "B": TOTAL_RED - red - white_captured})
+        successors = []
+        for coordinates, direction in sorted(game.legal_moves(turn)):
+            game.make_move(turn, coordinates, direction)
+            if game.get_winner() is not None:
+                child = TERMINAL
+            else:
+                child_marbles = dict(marbles)
+                for row, column in game.get_line(coordinates, direction):
+                    marble = game.get_marble((row, column))
+                    if marble == "X":
+                        child_marbles.pop(row * 7 + column, None)
+                    else:
+                        child_marbles[row * 7 + column] = marble
+                squares = sorted(child_marbles)
+                child = self._layout.index(squares, "".join([child_marbles[square] for square in squares]),
+                                           game.get_current_turn(), game.get_captured("W"))
+            game.unmake_move()
+            successors.append((encode_move(coordinates, direction), child))
+        return successors
+
+    def build(self):
+        """
+        Solves every class, from the fewest marbles up.
+        """
+        for marbles in range(3, self._max_marbles + 1):
+            group = [klass for klass in self._classes if sum(klass[:3]) == marbles]
+            if len(group) == 0:
+                continue
+            start = self._layout.get_class_range(*group[0][:3])[0]
+            end = self._layout.get_class_range(*group[-1][:3])[1]
+            began = time.perf_counter()
+            # positions are not generated in index order, so each one keeps where its successors start and how many
+            firsts = array("i", [0]) * (end - start)
+            counts = array("B", [0]) * (end - start)
+            children = array("i")
+            moves = array("B")
+            for white, black, red, least, splits in group:
+                colorings = get_colorings(white, black, red)
+                for squares in itertools.combinations(range(49), marbles):
+                    for coloring in colorings:
+                        position = dict(zip(squares, coloring))
+                        for white_captured in range(least, least + splits):
+                            for turn in SIDES:
+                                index = self._layout.index(squares, coloring, turn, white_captured)
+                                successors = self.get_successors(position, turn, white_captured)
+                                firsts[index - start] = len(children)
+                                counts[index - start] = len(successors)
+                                for move, child in successors:
+                                    moves.append(move)
+                                    children.append(child)
+            if self._progress is not None:
+                self._progress("%d marbles: %d positions, %d moves generated, %.1fs"
+                               % (marbles, end - start, len(moves), time.perf_counter() - began))
+            passes, changed = self.solve(marbles, start, end, firsts, counts, children, moves)
+            if self._progress is not None:
+                self._progress("%d marbles: %d positions, %d passes%s, %.1fs"
+                               % (marbles, end - start, passes,
+                                  " (stopped at the cap with %d positions still changing)" % changed if changed else "",
+                                  time.perf_counter() - began))
+
+    def solve(self, marbles, start, end, firsts, counts, children, moves):
+        """
+        Takes the number of marbles and the range of their positions and successors.
+        Recomputes every value from the values of the previous pass until a pass changes nothing or
+        the most passes are done. Returns the number of passes and the positions the last pass changed.
+        """
+        values = self._values
+        second_values = self._second_values
+        best_children = self._best_children
+        began = time.perf_counter()
+        passes = 0
+        changed = 1
+        while changed and passes < self._max_passes:
+            passes += 1
+            results = []
+            for index in range(start, end):
+                best = second = None
+                best_move = second_move = NO_MOVE
+                best_child = TERMINAL
+                first = firsts[index - start]
+                for successor in range(first, first + counts[index - start]):
+                    child = children[successor]
+                    if child == TERMINAL:
+                        value = WIN_VALUE - 1
+                    elif best_children[child] == index:
+                        # the child's best move would recreate this board, which ko forbids
+                        value = get_child_value(second_values[child])
+                    else:
+                        value = get_child_value(values[child])
+                    if best is None or value > best:
+                        second, second_move = best, best_move
+                        best, best_move, best_child = value, moves[successor], child
+                    elif second is None or value > second:
+                        second, second_move = value, moves[successor]
+                results.append((best or 0, second or 0, best_move, second_move, best_child))
+
+            changed = 0
+            for index, (best, second, best_move, second_move, best_child) in enumerate(results, start):
+                if (values[index] != best or second_values[index] != second
+                        or best_children[index] != best_child):
+                    changed += 1
+                values[index] = best
+                second_values[index] = second
+                self._moves[index] = best_move
+                self._second_moves[index] = second_move
+                best_children[index] = best_child
+            if self._progress is not None:
+                self._progress("%d marbles: pass %d changed %d positions, %.1fs"
+                               % (marbles, passes, changed, time.perf_counter() - began))
+        return passes, changed
+
+    def write(self, path):
+        """
+        Takes a path. Writes the table to it.
+        """
+        with open(path, "wb") as file:
+            file.write(_HEADER.pack(MAGIC, VERSION, self._max_marbles, len(self._classes)))
+            for white, black, red, least, splits in self._classes:
+                first = self._layout.get_class_range(white, black, red)[0]
+                file.write(_CLASS.pack(white, black, red, least, splits, first))
+            entries = bytearray(_ENTRY.size * self._layout.get_size())
+            for index in range(self._layout.get_size()):
+                _ENTRY.pack_into(entries, index * _ENTRY.size, self._values[index], self._second_values[index],
+                                 self._moves[index], self._second_moves[index])
+            file.write(entries)
+
+
+def build(path, max_marbles, progress=None, max_passes=MAX_PASSES):
+    """
+    Takes a path, the most marbles on the board, a function progress(message) and the most solver passes.
+    Solves every position with at most that many marbles and writes the table to the path.
+    """
+    builder = TablebaseBuilder(max_marbles, progress, max_passes)
+    builder.build()
+    builder.write(path)
+
+
+class Tablebase:
+    """
+    The class representing a memory-mapped table written by build.
+    """
+    def __init__(self, path):
+        """
+        Takes the path of a table. Maps it into memory.
+        """
+        self._file = open(path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, max_marbles, count = _HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d Kuba tablebase" % (path, VERSION))
+        self._max_marbles = max_marbles
+        classes = []
+        firsts = []
+        for number in range(count):
+            white, black, red, least, splits, first = _CLASS.unpack_from(self._data, _HEADER.size
+                                                                         + number * _CLASS.size)
+            classes.append((white, black, red, least, splits))
+            firsts.append(first)
+        self._layout = TablebaseLayout(classes, firsts)
+        self._entries = _HEADER.size + count * _CLASS.size
+
+    def close(self):
+        """
+        Unmaps and closes the table.
+        """
+        self._data.close()
+        self._file.close()
+
+    def get_max_marbles(self):
+        """
+        Returns the most marbles on the board of the positions in the table.
+        """
+        return self._max_marbles
+
+    def probe_position(self, board, turn, captures):
+        """
+        Takes a board as a string of marbles in row-major order, the color to move and a dict of red
+        captures by color. Returns the entry (value, value without the best move, best move, second
+        best move) of the position, or None if it is not in the table.
+        """
+        squares = [square for square in range(49) if board[square] != "X"]
+        if turn not in SIDES or len(squares) > self._max_marbles:
+            return None
+        coloring = "".join([board[square] for square in squares])
+        if captures["W"] + captures["B"] + coloring.count("R") != TOTAL_RED:
+            return None
+        index = self._layout.index(squares, coloring, turn, captures["W"])
+        if index is None:
+            return None
+        return _ENTRY.unpack_from(self._data, self._entries + index * _ENTRY.size)
+
+    def probe(self, game):
+        """
+        Takes a KubaGame. Returns the value of its position to the player to move and the best
+        (coordinates, direction) allowed by ko (None if the player has no legal move), or None if
+        the position is not in the table. The table only holds positions of the 7x7 game won with
+        WIN_RED captures, so games of other sizes are never in it.
+        """
+        if game.get_size() != BOARD_SIZE or game.get_red_to_win() != WIN_RED:
+            return None
+        if sum(game.get_marble_count()) > self._max_marbles or game.get_winner() is not None:
+            return None
+        entry = self.probe_position(*get_position(game))
+        if entry is None:
+            return None
+        value, second_value, move, second_move = entry
+        if move == NO_MOVE:
+            return value, None
+        coordinates, direction = decode_move(move)
+        history = game.get_pre_oppo_move()
+        counter = game.count_consecutive(coordinates, direction)
+        if (len(history) > 0 and counter is not None
+                and game.get_push_hash(coordinates, direction, counter) == history[0]):
+            # ko forbids the best move
+            if second_move == NO_MOVE:
+                return second_value, None
+            return second_value, decode_move(second_move)
+        return value, (coordinates, direction)
+
+
+def describe(value):
+    """
+    Takes a table value. Returns it in words, e.g. "win in 3", "loss in 4" or "draw".
+    """
+    if value > 0:
+        return "win in %d" % (WIN_VALUE - value)
+    if value < 0:
+        return "loss in %d" % (WIN_VALUE + value)
+    return "draw"
+
+
+def main(argv=None):
+    """
+    Takes the command line arguments. Builds a table.
+    """
+    parser = argparse.ArgumentParser(description="Build a KubaGame endgame tablebase.")
+    parser.add_argument("path", help="file to write the table to")
+    parser.add_argument("--marbles", type=int, default=3, help="most marbles on the board")
+    parser.add_argument("--max-passes", type=int, default=MAX_PASSES, help="most solver passes per number of marbles")
+    args = parser.parse_args(argv)
+    build(args.path, args.marbles, lambda message: print(message, flush=True), args.max_passes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# Description: Round-robin tournament runner for KubaGame agents. Every pair of agents plays both color
+# assignments (each agent plays W, and so moves first, once per round) across a ProcessPoolExecutor. Results
+# stream back in schedule order and update the Elo ratings one game at a time, and the progress is
+# checkpointed to a JSON file so that a stopped tournament resumes where it left off. The summary
+# reports the games/sec of every worker process.
+#
+# An agent is a picklable move policy as in KubaSelfPlay, policy(game, playerName, rng), e.g. random_policy
+# or a PlayerPolicy wrapping a search player.
+#
+# Usage: python KubaTournament.py [--rounds R] [--workers N] [--time-limit S] [--checkpoint PATH]
+import argparse
+import json
+import os
+import time
+
+from KubaSelfPlay import close_policy, game_rng, play_game, random_policy, run_bounded
+
+INITIAL_RATING = 1500.0
+
+
+class PlayerPolicy:
+    """
+    The class representing a move policy that asks a search player, such as AlphaBetaPlayer or
+    MCTSPlayer, for its move. A new player is created for every game, and the previous one is
+    closed if it has a close() method.
+    """
+    def __init__(self, player_class, seeded=False, **settings):
+        """
+        Takes the player class, whether to seed each player from the game's random.Random, and
+        the keyword arguments to create it with.
+        """
+        self._player_class = player_class
+        self._seeded = seeded
+        self._settings = settings
+        self._player = None
+        self._game = None
+
+    def __call__(self, game, playerName, rng):
+        """
+        Takes a game, the name of the player to move and a random.Random.
+        Returns the player's move, or None if it has no legal move.
+        """
+        if self._game is not game:
+            self.close()
+            settings = dict(self._settings)
+            if self._seeded:
+                settings["seed"] = rng.getrandbits(32)
+            self._player = self._player_class(**settings)
+            self._game = game
+        return self._player.choose_move(game, playerName)
+
+    def close(self):
+        """
+        Closes the current player, if it has a close() method, and forgets it.
+        """
+        close_policy(self._player)
+        self._player = None
+        self._game = None
+
+    def __enter__(self):
+        """
+        Returns the policy, to be closed when the with block ends.
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """
+        Closes the policy.
+        """
+        self.close()
+
+
+def get_schedule(names, rounds=1):
+    """
+    Takes the agent names and the number of rounds.
+    Returns the list of (white, black) games: every pair of agents once with each color per round.
+    """
+    schedule = []
+    for round_index in range(rounds):
+        for first in range(len(names)):
+            for second in range(first + 1, len(names)):
+                schedule.append((names[first], names[second]))
+                schedule.append((names[second], names[first]))
+    return schedule
+
+
+def get_expected_score(rating, opponent_rating):
+    """
+    Takes two Elo ratings. Returns the expected score of the first against the second.
+    """
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / 400.0))
+
+
+def update_ratings(ratings, white, black, score, k_factor):
+    """
+    Takes the dict of ratings, the two agent names, the score of white (1, 0.5 or 0) and the K-factor.
+    Updates the ratings of both agents with the result.
+    """
+    expected = get_expected_score(ratings[white], ratings[black])
+    ratings[white] += k_factor * (score - expected)
+    ratings[black] -= k_factor * (score - expected)
+
+
+def play_match(policy_white, policy_black, players, seed, index, max_moves):
+    """
+    Takes the policies of the white and black agents, the two (agent name, color) tuples, the seed
+    of the tournament, the index of the game in the schedule and the most moves to play.
+    Plays the game. Returns its record with the game index, the worker process id and the seconds
+    taken. Closes the policies afterwards. Runs in a worker process.
+    """
+    start = time.perf_counter()
+    try:
+        record = play_game(policy_white, policy_black, game_rng(seed, index), max_moves, players)
+    finally:
+        close_policy(policy_white)
+        close_policy(policy_black)
+    record["game"] = index
+    record["worker"] = os.getpid()
+    record["seconds"] = time.perf_counter() - start
+    return record
+
+
+def load_checkpoint(path, names, rounds, seed):
+    """
+    Takes the path of a checkpoint file and the agent names, rounds and seed of the tournament.
+    Returns the saved progress, or None if the file does not exist.
+    Raises ValueError if the checkpoint belongs to a different tournament.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path) as file:
+        state = json.load(file)
+    if state["agents"] != list(names) or state["rounds"] != rounds or state["seed"] != seed:
+        raise ValueError("checkpoint %s is of a different tournament" % path)
+    return state
+
+
+def save_checkpoint(path, state):
+    """
+    Takes the path of a checkpoint file and the progress. Writes it to a temporary file first and
+    then renames it, so a checkpoint is never left half written.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        json.dump(state, file, indent=1)
+    os.replace(temporary, path)
+
+
+def run_tournament(agents, rounds=1, seed=0, workers=None, max_moves=500, checkpoint=None,
+                   checkpoint_every=20, k_factor=16.0):
+    """
+    Takes a dict of agent policies by name, the number of rounds, the seed, the number of worker
+    processes, the most moves per game, the path of a checkpoint file (None for none), how many
+    games to play between checkpoints and the Elo K-factor.
+    Plays the round robin, resuming from the checkpoint if it exists. Ratings are updated in
+    schedule order, so for agents without time budgets they only depend on the seed, not on the
+    number of workers.
+    Returns a dict with the games played, the ratings and the wins, losses and draws of every
+    agent, the seconds taken by this run, and the games, seconds and games/sec of every worker.
+    """
+    names = list(agents)
+    schedule = get_schedule(names, rounds)
+    state = load_checkpoint(checkpoint, names, rounds, seed)
+    if state is None:
+        state = {"agents": names, "rounds": rounds, "seed": seed, "completed": 0,
+                 "ratings": {name: INITIAL_RATING for name in names},
+                 "standings": {name: {"wins": 0, "losses": 0, "draws": 0} for name in names}}
+
+    start = time.perf_counter()
+    worker_stats = {}
+    completed = state["completed"]
+
+    def record_result(record):
+        white, black = schedule[record["game"]]
+        if record["winner"] is None:
+            score = 0.5
+            state["standings"][white]["draws"] += 1
+            state["standings"][black]["draws"] += 1
+        else:
+            score = 1.0 if record["winner"] == white else 0.0
+            state["standings"][record["winner"]]["wins"] += 1
+            state["standings"][black if record["winner"] == white else white]["losses"] += 1
+        update_ratings(state["ratings"], white, black, score, k_factor)
+        stats = worker_stats.setdefault(record["worker"], {"games": 0, "seconds": 0.0})
+        stats["games"] += 1
+        stats["seconds"] += record["seconds"]
+        state["completed"] = record["game"] + 1
+        if checkpoint is not None and state["completed"] % checkpoint_every == 0:
+            save_checkpoint(checkpoint, state)
+
+    matches = ((agents[white], agents[black], ((white, "W"), (black, "B")), seed, index, max_moves)
+               for index, (white, black) in enumerate(schedule[completed:], completed))
+    for record in run_bounded(play_match, matches, workers):
+        record_result(record)
+    if checkpoint is not None:
+        save_checkpoint(checkpoint, state)
+
+    for stats in worker_stats.values():
+        stats["games_per_sec"] = stats["games"] / stats["seconds"] if stats["seconds"] else 0.0
+    return {
+        "games": state["completed"],
+        "ratings": state["ratings"],
+        "standings": state["standings"],
+        "seconds": time.perf_counter() - start,
+        "workers": worker_stats,
+    }
+
+
+def main(argv=None):
+    """
+    Takes the command line arguments. Runs a tournament between the random, alpha-beta and MCTS
+    players and prints the ratings.
+    """
+    from KubaMCTS import MCTSPlayer
+    from KubaSearch import AlphaBetaPlayer
+
+    parser = argparse.ArgumentParser(description="Run a round-robin tournament between KubaGame agents.")
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-moves", type=int, default=200)
+    parser.add_argument("--time-limit", type=float, default=0.05, help="seconds per move of the search players")
+    parser.add_argument("--checkpoint", help="JSON file to save progress to and resume from")
+    args = parser.parse_args(argv)
+
+    agents = {
+        "random": random_policy,
+        "alphabeta": PlayerPolicy(AlphaBetaPlayer, time_limit=args.time_limit),
+        "mcts": PlayerPolicy(MCTSPlayer, seeded=True, time_limit=args.time_limit),
+    }
+    result = run_tournament(agents, args.rounds, args.seed, args.workers, args.max_moves, args.checkpoint)
+    for name, rating in sorted(result["ratings"].items(), key=lambda item: -item[1]):
+        print("%-10s %7.1f %s" % (name, rating, result["standings"][name]))
+    for worker, stats in sorted(result["workers"].items()):
+        print("worker %d: %d games, %.2f games/sec" % (worker, stats["games"], stats["games_per_sec"]))
+    print("%d games in %.1fs" % (result["games"], result["seconds"]))
+
+
+if __name__ == "__main__":
+    main()